@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the DarkSky forecast API.
+
+Serves /forecast/<key>/<lat>,<lon>?units=..&exclude=.. with either a
+recorded response (--payload file.json) or a synthetic one.  Latency,
+error rate and payload size can be set so polls can be measured
+without using the real API.
+
+    python3 bench/fake_darksky.py --port 8089 --latency 0.2 --errors 0.1
+
+then point nodes.darksky.API_URL at http://127.0.0.1:8089/forecast/
+"""
+
+import argparse
+import gzip
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ICONS = ['clear-day', 'clear-night', 'rain', 'snow', 'sleet', 'wind',
+         'fog', 'cloudy', 'partly-cloudy-day', 'partly-cloudy-night']
+
+
+def data_point(t, rnd):
+    return {
+        'time': t,
+        'summary': 'Synthetic',
+        'icon': rnd.choice(ICONS),
+        'precipIntensity': round(rnd.uniform(0, 2), 4),
+        'precipProbability': round(rnd.uniform(0, 1), 2),
+        'precipType': 'rain',
+        'temperature': round(rnd.uniform(-5, 30), 2),
+        'apparentTemperature': round(rnd.uniform(-8, 32), 2),
+        'dewPoint': round(rnd.uniform(-10, 20), 2),
+        'humidity': round(rnd.uniform(0.2, 1), 2),
+        'pressure': round(rnd.uniform(990, 1030), 1),
+        'windSpeed': round(rnd.uniform(0, 15), 2),
+        'windGust': round(rnd.uniform(0, 25), 2),
+        'windBearing': rnd.randint(0, 359),
+        'cloudCover': round(rnd.uniform(0, 1), 2),
+        'uvIndex': rnd.randint(0, 11),
+        'visibility': round(rnd.uniform(1, 16), 3),
+        'ozone': round(rnd.uniform(250, 400), 1),
+    }
+
+
+def daily_point(t, rnd):
+    d = data_point(t, rnd)
+    d.update({
+        'temperatureMax': round(rnd.uniform(15, 35), 2),
+        'temperatureMin': round(rnd.uniform(-5, 14), 2),
+        'moonPhase': round(rnd.uniform(0, 1), 2),
+        'precipAccumulation': round(rnd.uniform(0, 3), 3),
+        'sunriseTime': t + 21600,
+        'sunsetTime': t + 64800,
+    })
+    return d
+
+
+# Build a response that looks like a DarkSky forecast.  padding adds
+# that many bytes of alert text to make the payload bigger.
+def synthetic(lat, lon, now=None, padding=0, seed=None):
+    rnd = random.Random(seed)
+    if now is None:
+        now = int(time.time())
+    hour = now - now % 3600
+    day = now - now % 86400
+
+    payload = {
+        'latitude': lat,
+        'longitude': lon,
+        'timezone': 'UTC',
+        'currently': data_point(now, rnd),
+        'minutely': {'summary': 'Synthetic', 'icon': 'rain',
+            'data': [{'time': now + 60 * m,
+                      'precipIntensity': round(rnd.uniform(0, 2), 4),
+                      'precipProbability': round(rnd.uniform(0, 1), 2)} for m in range(61)]},
+        'hourly': {'summary': 'Synthetic', 'icon': 'rain',
+            'data': [data_point(hour + 3600 * h, rnd) for h in range(49)]},
+        'daily': {'summary': 'Synthetic', 'icon': 'rain',
+            'data': [daily_point(day + 86400 * d, rnd) for d in range(8)]},
+        'alerts': [],
+        'flags': {'sources': ['synthetic'], 'units': 'si'},
+        'offset': 0,
+    }
+
+    if padding > 0:
+        payload['alerts'].append({
+            'title': 'Synthetic Alert',
+            'regions': ['Nowhere'],
+            'severity': 'advisory',
+            'time': now,
+            'expires': now + 3600,
+            'description': 'x' * padding,
+            'uri': 'https://example.invalid/alert',
+        })
+
+    return payload
+
+
+class FakeDarkSky(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, errors=0.0, padding=0, payload=None, max_age=0):
+        super().__init__(address, Handler)
+        self.latency = latency
+        self.errors = errors
+        self.padding = padding
+        self.payload = payload
+        self.max_age = max_age
+        self.calls = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+
+        # Synthetic responses are generated once per location and
+        # variant so that building them doesn't skew the timings.
+        self.variants = 4
+        self.responses = {}
+
+    def url(self):
+        return 'http://%s:%d/forecast/' % self.server_address[:2]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name='FakeDarkSky')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # Headers and body are written separately, without this delayed
+    # ACKs add ~40ms to every keep-alive response.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.calls += 1
+            calls = server.calls
+
+        if server.latency > 0:
+            time.sleep(server.latency)
+
+        url = urllib.parse.urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        if len(parts) != 3 or parts[0] != 'forecast':
+            return self.reply(404, {'code': 404, 'error': 'Not found'}, calls)
+
+        if random.random() < server.errors:
+            return self.reply(503, {'code': 503, 'error': 'Synthetic failure'}, calls)
+
+        try:
+            (lat, lon) = [float(v) for v in parts[2].split(',')[:2]]
+        except ValueError:
+            return self.reply(400, {'code': 400, 'error': 'The given location is invalid.'}, calls)
+
+        exclude = ','.join(urllib.parse.parse_qs(url.query).get('exclude', []))
+        compress = 'gzip' in self.headers.get('Accept-Encoding', '')
+        key = (lat, lon, exclude, compress, calls % server.variants)
+
+        body = server.responses.get(key)
+        if body is None:
+            if server.payload is not None:
+                payload = dict(server.payload)
+            else:
+                payload = synthetic(lat, lon, padding=server.padding, seed=hash(key))
+            for block in exclude.split(','):
+                payload.pop(block, None)
+            body = self.encode(payload, compress)
+            server.responses[key] = body
+
+        self.reply(200, body, calls, compress)
+
+    def encode(self, payload, compress):
+        body = json.dumps(payload).encode('utf-8')
+        if compress:
+            body = gzip.compress(body)
+        return body
+
+    def reply(self, status, body, calls, compress=False):
+        if isinstance(body, dict):
+            compress = 'gzip' in self.headers.get('Accept-Encoding', '')
+            body = self.encode(body, compress)
+        encoding = 'gzip' if compress else None
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Forecast-API-Calls', str(calls))
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+        if status == 200 and self.server.max_age > 0:
+            self.send_header('Cache-Control', 'max-age=%d' % self.server.max_age)
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.bytes_sent += len(body)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local DarkSky forecast API stand-in')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to delay each response')
+    parser.add_argument('--errors', type=float, default=0.0, help='fraction of requests that fail with 503')
+    parser.add_argument('--padding', type=int, default=0, help='extra bytes of alert text per response')
+    parser.add_argument('--max-age', type=int, default=0, help='Cache-Control max-age to send')
+    parser.add_argument('--payload', help='serve this recorded response instead of synthetic data')
+    args = parser.parse_args()
+
+    payload = None
+    if args.payload:
+        with open(args.payload) as pf:
+            payload = json.load(pf)
+
+    server = FakeDarkSky(('127.0.0.1', args.port), args.latency, args.errors, args.padding, payload, args.max_age)
+    print('Serving fake DarkSky API at ' + server.url())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
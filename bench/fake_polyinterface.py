@@ -0,0 +1,161 @@
+"""
+Minimal stand-in for polyinterface used by the benchmarks.
+
+Provides just enough of Interface, Node and Controller for the node
+server classes to run without Polyglot.  Nothing is sent anywhere,
+setDriver calls and the reports they would have sent are counted.
+
+Install it before importing any node server module:
+
+    import fake_polyinterface
+    fake_polyinterface.install()
+"""
+
+import collections
+import copy
+import logging
+import sys
+
+LOGGER = logging.getLogger('darksky-bench')
+
+# setDriver calls and the status reports they generated, by node address
+SET_DRIVER_CALLS = collections.Counter()
+REPORTS = collections.Counter()
+
+
+def reset_counters():
+    SET_DRIVER_CALLS.clear()
+    REPORTS.clear()
+
+
+class Interface:
+    def __init__(self, name, params=None):
+        self.name = name
+        self.config = {
+            'customParams': dict(params or {}),
+            'customData': {},
+            'notices': {},
+            'nodes': [],
+        }
+        self.notices = []
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def onConfig(self, callback):
+        self.config_callback = callback
+
+    def onStop(self, callback):
+        self.stop_callback = callback
+
+    def send(self, message):
+        pass
+
+    def addNode(self, node):
+        pass
+
+    def delNode(self, address):
+        pass
+
+    def saveCustomData(self, data):
+        self.config['customData'] = data
+
+    def saveCustomParams(self, data):
+        self.config['customParams'] = data
+
+    def addNotice(self, data):
+        self.notices.append(data)
+
+    def removeNotice(self, data):
+        pass
+
+    def installprofile(self):
+        pass
+
+
+class Node:
+    id = ''
+    commands = {}
+    drivers = []
+    hint = [0, 0, 0, 0]
+
+    def __init__(self, controller, primary, address, name):
+        self.controller = controller
+        self.parent = controller
+        self.primary = primary
+        self.address = address
+        self.name = name
+        self.drivers = copy.deepcopy(self.drivers)
+        self._reported = {d['driver']: (d['value'], d['uom']) for d in self.drivers}
+
+    def setDriver(self, driver, value, report=True, force=False, uom=None):
+        SET_DRIVER_CALLS[self.address] += 1
+        for d in self.drivers:
+            if d['driver'] == driver:
+                d['value'] = value
+                if uom is not None:
+                    d['uom'] = uom
+                if report:
+                    reported = (str(value), d['uom'])
+                    if force or self._reported.get(driver) != reported:
+                        self._reported[driver] = reported
+                        REPORTS[self.address] += 1
+                break
+
+    def reportDrivers(self):
+        pass
+
+    def start(self):
+        pass
+
+    def runCmd(self, command):
+        if command['cmd'] in self.commands:
+            self.commands[command['cmd']](self, command)
+
+
+class Controller(Node):
+    def __init__(self, poly, name='Controller'):
+        self.poly = poly
+        self.controller = self
+        self.parent = self
+        self.name = name
+        self.address = 'controller'
+        self.primary = self.address
+        self.drivers = copy.deepcopy(self.drivers)
+        self._reported = {d['driver']: (d['value'], d['uom']) for d in self.drivers}
+        self.polyConfig = poly.config
+        self.nodes = {}
+
+    def addNode(self, node, update=False):
+        self.nodes[node.address] = node
+        return node
+
+    def delNode(self, address):
+        self.nodes.pop(address, None)
+
+    def addNotice(self, data, key=None):
+        self.poly.addNotice({'key': key, 'value': data})
+
+    def removeNotice(self, key):
+        pass
+
+    def removeNoticesAll(self):
+        pass
+
+    def addCustomParam(self, data):
+        self.poly.config['customParams'].update(data)
+
+    def saveCustomData(self, data):
+        self.poly.saveCustomData(data)
+
+    def runForever(self):
+        pass
+
+
+def install():
+    module = sys.modules[__name__]
+    sys.modules['polyinterface'] = module
+    return module
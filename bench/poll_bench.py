@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+End to end poll benchmark.
+
+Runs Controller.query_conditions against the local fake DarkSky server
+using the fake polyinterface, and reports per poll wall time, CPU time,
+memory allocations and setDriver calls for each forecast day setting.
+
+    python3 bench/poll_bench.py --days 1,7 --polls 20 --latency 0.05
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import fake_polyinterface
+fake_polyinterface.install()
+
+import fake_darksky
+from nodes import darksky
+
+
+def make_controller(server, days, locations):
+    params = {
+        'APIKey': 'benchmark',
+        'Location': ';'.join(['%.4f,%.4f' % (42.36 + i, -71.05 - i) for i in range(locations)]),
+        'Units': 'us',
+        'Forecast Days': str(days),
+        'Elevation': '100',
+        'Plant Type': '0.23',
+        'Cache TTL': '0',
+        'Daily Budget': '0',
+    }
+    darksky.API_URL = server.url()
+    poly = fake_polyinterface.Interface('DARKSKY', params)
+    control = darksky.Controller(poly)
+    control.nodes[control.address] = control
+    control.check_params()
+    control.discover()
+    return control
+
+
+def run(server, days, locations, polls):
+    control = make_controller(server, days, locations)
+
+    # Warm up the connection and the node state
+    control.query_conditions(True)
+
+    wall = []
+    cpu = []
+    allocated = []
+    blocks = []
+    fake_polyinterface.reset_counters()
+    calls = server.calls
+
+    for i in range(polls):
+        tracemalloc.start()
+        w = time.perf_counter()
+        c = time.process_time()
+        control.query_conditions(False)
+        cpu.append(time.process_time() - c)
+        wall.append(time.perf_counter() - w)
+        snapshot = tracemalloc.take_snapshot()
+        (current, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        allocated.append(peak)
+        blocks.append(sum(stat.count for stat in snapshot.statistics('filename')))
+
+    control.stop()
+
+    return {
+        'days': days,
+        'locations': locations,
+        'polls': polls,
+        'fetches': server.calls - calls,
+        'wall_ms': statistics.median(wall) * 1000,
+        'wall_max_ms': max(wall) * 1000,
+        'cpu_ms': statistics.median(cpu) * 1000,
+        'peak_kb': statistics.median(allocated) / 1024,
+        'live_blocks': statistics.median(blocks),
+        'set_driver': sum(fake_polyinterface.SET_DRIVER_CALLS.values()) / polls,
+        'reports': sum(fake_polyinterface.REPORTS.values()) / polls,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DarkSky node server poll benchmark')
+    parser.add_argument('--days', default='1,7', help='comma separated forecast day settings to run')
+    parser.add_argument('--locations', type=int, default=1)
+    parser.add_argument('--polls', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.0, help='fake server latency in seconds')
+    parser.add_argument('--errors', type=float, default=0.0, help='fraction of fake server requests that fail')
+    parser.add_argument('--padding', type=int, default=0, help='extra bytes per response')
+    args = parser.parse_args()
+
+    # Keep the cache, quota and snapshot files out of the source tree
+    os.chdir(tempfile.mkdtemp(prefix='darksky-bench-'))
+
+    server = fake_darksky.FakeDarkSky(('127.0.0.1', 0), args.latency, args.errors, args.padding)
+    server.start()
+
+    print('%5s %5s %8s %8s %8s %9s %8s %10s %8s' % ('days', 'locs', 'wall ms', 'max ms', 'cpu ms', 'peak KiB', 'blocks', 'setDriver', 'reports'))
+    for days in [int(d) for d in args.days.split(',')]:
+        r = run(server, days, args.locations, args.polls)
+        print('%5d %5d %8.2f %8.2f %8.2f %9.1f %8d %10.1f %8.1f' % (
+            r['days'], r['locations'], r['wall_ms'], r['wall_max_ms'], r['cpu_ms'],
+            r['peak_kb'], r['live_blocks'], r['set_driver'], r['reports']))
+
+    server.stop()
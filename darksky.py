@@ -12,6 +12,7 @@ except ImportError:
     import pgc_interface as polyinterface
 from nodes import darksky
 from nodes import darksky_daily
+from nodes import metrics
 
 LOGGER = polyinterface.LOGGER
 
@@ -19,6 +20,7 @@ if __name__ == "__main__":
     try:
         polyglot = polyinterface.Interface('DARKSKY')
         polyglot.start()
+        metrics.start_from_env()
         control = darksky.Controller(polyglot)
         control.runForever()
     except (KeyboardInterrupt, SystemExit):
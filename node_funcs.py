@@ -8,6 +8,10 @@ except ImportError:
     import pgc_interface as polyinterface
 
 
+import collections
+import time
+from nodes import metrics
+
 LOGGER = polyinterface.LOGGER
 
 """
@@ -27,14 +31,37 @@ def add_functions_as_methods(functions):
 
 
 # Wrap all the setDriver calls so that we can check that the 
-# value exist first.
+# value exist first.  If the controller has a driver filter, values
+# that haven't changed enough, or were published too recently, are
+# skipped.  If the controller has a publish transaction open, the
+# value is held until the transaction is committed.
 def update_driver(self, driver, value, force=False, prec=3):
     try:
-        self.setDriver(driver, round(float(value), prec), True, force, self.uom[driver])
-        LOGGER.debug('setDriver (%s, %f)' %(driver, float(value)))
+        value = round(float(value), prec)
+        driver_filter = getattr(self.controller, 'driver_filter', None)
+        if driver_filter is not None and not force:
+            (publish, force) = driver_filter.check(self.address, driver, value)
+            if not publish:
+                LOGGER.debug('filtered (%s, %f)', driver, value)
+                return
+
+        transaction = getattr(self.controller, 'transaction', None)
+        if transaction is not None:
+            transaction.add(self, driver, value, force)
+        else:
+            self.publish_driver(driver, value, force)
     except:
         LOGGER.warning('Missing data for driver ' + driver)
 
+def publish_driver(self, driver, value, force=False):
+    self.setDriver(driver, value, True, force, self.uom[driver])
+    LOGGER.debug('setDriver (%s, %f)', driver, value)
+    metrics.PUBLISHES.inc(self.address)
+
+    driver_filter = getattr(self.controller, 'driver_filter', None)
+    if driver_filter is not None:
+        driver_filter.record(self.address, driver, value)
+
 def get_saved_log_level(self):
     if 'customData' in self.polyConfig:
         if 'level' in self.polyConfig['customData']:
@@ -66,7 +93,116 @@ def set_logging_level(self, level=None):
     LOGGER.info('set_logging_level: Setting log level to %d' % level)
     LOGGER.setLevel(level)
 
-functions = (update_driver, get_saved_log_level, save_log_level, set_logging_level)
+functions = (update_driver, publish_driver, get_saved_log_level, save_log_level, set_logging_level)
+
+"""
+    Filter driver updates to cut down on traffic to the ISY.
+
+    deadbands is a string of driver:band pairs, separated by commas.
+    A band ending in % is relative to the last published value.
+
+       BARPRES:0.5,GV10:2,CLIHUM:1%
+
+    A new value is only published when it differs from the last
+    published value by more than the driver's deadband and at least
+    min_interval seconds have passed since the last publish.  Every
+    heartbeat seconds the value is published regardless so that it
+    never goes stale on the ISY.  0 disables min_interval / heartbeat.
+"""
+
+class DriverFilter:
+    def __init__(self, deadbands='', min_interval=0, heartbeat=0):
+        self.published = {}
+        self.configure(deadbands, min_interval, heartbeat)
+
+    def configure(self, deadbands, min_interval, heartbeat):
+        self.deadbands = self.parse_deadbands(deadbands)
+        self.min_interval = min_interval
+        self.heartbeat = heartbeat
+
+    @staticmethod
+    def parse_deadbands(text):
+        deadbands = {}
+        for item in text.split(','):
+            if item.strip() == '':
+                continue
+            try:
+                (driver, band) = item.split(':')
+                band = band.strip()
+                if band.endswith('%'):
+                    deadbands[driver.strip()] = (0.0, float(band[:-1]) / 100)
+                else:
+                    deadbands[driver.strip()] = (float(band), 0.0)
+            except ValueError:
+                LOGGER.warning('Ignoring invalid deadband ' + item)
+        return deadbands
+
+    # Returns (publish, force)
+    def check(self, address, driver, value):
+        last = self.published.get((address, driver))
+        if last is None:
+            return (True, False)
+
+        (last_value, last_time) = last
+        elapsed = time.time() - last_time
+
+        if self.heartbeat > 0 and elapsed >= self.heartbeat:
+            return (True, True)
+
+        if elapsed < self.min_interval:
+            return (False, False)
+
+        if driver in self.deadbands:
+            (absolute, relative) = self.deadbands[driver]
+            change = abs(value - last_value)
+            if change <= absolute or change <= relative * abs(last_value):
+                return (False, False)
+
+        return (True, False)
+
+    def record(self, address, driver, value):
+        self.published[(address, driver)] = (value, time.time())
+
+"""
+    Collect driver updates from all nodes during a poll and publish
+    them together when the poll is done.  If the poll fails, nothing
+    is published.  Multiple updates to the same driver are coalesced
+    so only the last value is sent.
+
+    usage:
+       self.transaction = PublishTransaction()
+       ... update_driver() calls on any node ...
+       self.transaction.commit()  or  self.transaction.rollback()
+"""
+
+class PublishTransaction:
+    def __init__(self):
+        self.pending = collections.OrderedDict()
+
+    def add(self, node, driver, value, force):
+        key = (node.address, driver)
+        if key in self.pending:
+            # keep a force from an earlier update of the same driver
+            force = force or self.pending[key][3]
+            del self.pending[key]
+        self.pending[key] = (node, driver, value, force)
+
+    def commit(self):
+        count = 0
+        for (node, driver, value, force) in self.pending.values():
+            try:
+                node.publish_driver(driver, value, force)
+                count += 1
+            except Exception as e:
+                LOGGER.warning('Failed to publish %s for %s: %s' % (driver, node.address, str(e)))
+        self.pending.clear()
+        return count
+
+    def rollback(self):
+        count = len(self.pending)
+        self.pending.clear()
+        return count
+
 
 """
     Functions to handle custom parameters.
@@ -95,6 +231,7 @@ functions = (update_driver, get_saved_log_level, save_log_level, set_logging_lev
 class NSParameters:
     def __init__(self, parameters):
         self.internal = []
+        self.changed = []
 
         for p in parameters:
             self.internal.append({
@@ -176,29 +313,37 @@ class NSParameters:
         Called from process_config to check for configuration change
         We need to know two things; 1) did the configuration change and
         2) are all required fields filled in.
+
+        The names of the parameters that changed are left in
+        self.changed.
     """
     def update_from_polyglot(self, config):
-        changed = False
+        self.changed = []
         valid = True
 
         if 'customParams' in config:
             for p in self.internal:
                 if p['name'] in config['customParams']:
                     poly_param = config['customParams'][p['name']]
-
-                    # did it change?
-                    if poly_param != p['default'] and poly_param != p['value']:
-                        changed = True
+                    previous = self.get(p['name'])
 
                     # is it different from the default?
                     if poly_param != p['default']:
                         p['value'] = poly_param
                         p['isSet'] = True
+                    elif p['isSet']:
+                        # set back to the default
+                        p['value'] = poly_param
+                        p['isSet'] = False
+
+                    # did it change?
+                    if self.get(p['name']) != previous:
+                        self.changed.append(p['name'])
 
         for p in self.internal:
             if not p['isSet'] and p['isRequired']:
                 valid = False
 
-        return (valid, changed)
+        return (valid, len(self.changed) > 0)
 
 
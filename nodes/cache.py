@@ -0,0 +1,124 @@
+#
+#  Response cache for DarkSky forecast queries
+#
+#  Responses are keyed on the query (location, excluded blocks,
+#  forecast days and hours) and kept until they expire.  The expiration time is
+#  the smaller of the configured TTL and whatever the API's
+#  Cache-Control / Expires headers allow.  The cache is written to a local file so that a
+#  node server restart doesn't cost an API call.
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import json
+import os
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+LOGGER = polyinterface.LOGGER
+
+CACHE_FILE = 'darksky_cache.json'
+
+
+def make_key(location, exclude, days, hours=0):
+    return '%s|%s|%d|%d' % (location.replace(' ', ''), ','.join(sorted(exclude)), days, hours)
+
+
+# Return how long, in seconds, the headers say a response may be cached.
+# None means the headers don't say.
+def header_lifetime(headers, now=None):
+    if headers is None:
+        return None
+
+    cc = headers.get('Cache-Control', '')
+    if 'no-store' in cc or 'no-cache' in cc:
+        return 0
+    m = re.search(r'max-age\s*=\s*(\d+)', cc)
+    if m:
+        return int(m.group(1))
+
+    expires = headers.get('Expires')
+    if expires:
+        try:
+            if now is None:
+                now = time.time()
+            return max(0, parsedate_to_datetime(expires).timestamp() - now)
+        except (TypeError, ValueError):
+            return 0
+
+    return None
+
+
+class ResponseCache:
+    def __init__(self, ttl=0, filename=CACHE_FILE):
+        self.ttl = ttl
+        self.filename = filename
+        self.hits = 0
+        self.misses = 0
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.filename) as cf:
+                self.entries = json.load(cf)
+        except FileNotFoundError:
+            self.entries = {}
+        except Exception as e:
+            LOGGER.warning('Ignoring unreadable response cache: ' + str(e))
+            self.entries = {}
+
+    def save(self):
+        tmp = self.filename + '.tmp'
+        try:
+            with open(tmp, 'w') as cf:
+                json.dump(self.entries, cf)
+            os.replace(tmp, self.filename)
+        except Exception as e:
+            LOGGER.warning('Failed to save response cache: ' + str(e))
+
+    # Returns the cache entry, { 'data', 'fetched', 'expires' }, or None
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry['expires'] > now:
+                self.hits += 1
+                LOGGER.debug('cache hit for %s (%d hits, %d misses)' % (key, self.hits, self.misses))
+                return entry
+            self.misses += 1
+            LOGGER.debug('cache miss for %s (%d hits, %d misses)' % (key, self.hits, self.misses))
+            return None
+
+    def put(self, key, data, headers=None):
+        if self.ttl <= 0:
+            return
+
+        now = time.time()
+        lifetime = self.ttl
+        from_headers = header_lifetime(headers, now)
+        if from_headers is not None:
+            lifetime = min(lifetime, from_headers)
+        if lifetime <= 0:
+            return
+
+        with self.lock:
+            # Drop anything that has expired while we're here
+            self.entries = {k: e for k, e in self.entries.items() if e['expires'] > now}
+            self.entries[key] = {'fetched': now, 'expires': now + lifetime, 'data': data}
+            self.save()
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+            self.save()
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return self.hits / total
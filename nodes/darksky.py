@@ -9,14 +9,53 @@ try:
 except ImportError:
     import pgc_interface as polyinterface
 import sys
-import requests
 import json
+import time
+import threading
+import concurrent.futures
 import node_funcs
 from nodes import darksky_daily
+from nodes import darksky_current
+from nodes import darksky_stats
+from nodes import darksky_hourly
+from nodes import darksky_nowcast
+from nodes import darksky_alerts
+from nodes import history
+from nodes import interpolate
 from nodes import uom
+from nodes import et3
+from nodes import cache
+from nodes import session
+from nodes import shared_cache
+from nodes import mapping
+from nodes import poller
+from nodes import quota
+from nodes import snapshot
+from nodes import timing
+from nodes import metrics
+from nodes import profiler
 
 LOGGER = polyinterface.LOGGER
 
+API_URL = 'https://api.darksky.net/forecast/'
+
+# Data blocks in a forecast response
+BLOCKS = ['currently', 'minutely', 'hourly', 'daily', 'alerts', 'flags']
+
+# Limits on the number of locations and how many are fetched at once
+MAX_LOCATIONS = 8
+MAX_HOURS = 48
+FETCH_WORKERS = 4
+
+# Address of the rolling statistics node
+STATS_ADDRESS = 'stats'
+
+# Parameters that change which nodes exist
+NODE_PARAMS = ('Location', 'Forecast Days', 'Forecast Hours', 'Nowcast', 'Alerts', 'Statistics')
+
+# Parameters that only need the last responses processed again
+REPLAY_PARAMS = NODE_PARAMS + ('Units', 'Elevation', 'Plant Type')
+
 @node_funcs.add_functions_as_methods(node_funcs.functions)
 class Controller(polyinterface.Controller):
     id = 'dsweather'
@@ -54,6 +93,12 @@ class Controller(polyinterface.Controller):
             'notice': '',
             },
             {
+            'name': 'Forecast Hours',
+            'default': '0',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
             'name': 'Elevation',
             'default': '0',
             'isRequired': False,
@@ -65,8 +110,105 @@ class Controller(polyinterface.Controller):
             'isRequired': False,
             'notice': '',
             },
+            {
+            'name': 'Cache TTL',
+            'default': '900',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'Shared Cache',
+            'default': '',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'Deadband',
+            'default': '',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'Min Publish Interval',
+            'default': '0',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'Heartbeat',
+            'default': '0',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'Daily Budget',
+            'default': '1000',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'Max Data Age',
+            'default': '3600',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'Nowcast',
+            'default': '0',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'Alerts',
+            'default': '0',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'Interpolate',
+            'default': '0',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'Statistics',
+            'default': '0',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'History Size',
+            'default': '0',
+            'isRequired': False,
+            'notice': '',
+            },
             ])
 
+        self.cache = cache.ResponseCache()
+        self.shared = shared_cache.SharedCache()
+        self.driver_filter = node_funcs.DriverFilter()
+        self.transaction = None
+        self.poller = poller.PollWorker(self.query_conditions, self.refresh)
+        self.interpolator = interpolate.Interpolator()
+        self.quota = quota.QuotaManager()
+        self.history = history.HistoryStore()
+        self.data_time = 0
+        self.stale = None
+        self.timer = timing.PollTimer()
+        self.profiler = profiler.Profiler()
+        self.fetch_stats = {}
+        self.fetch_headers = {}
+        self.failures = 0
+        self.units = None
+        self.last_query = None
+        self.last_results = None
+        self.replay_params = set()
+        self.rediscover = False
+        self.replay_lock = threading.Lock()
+        self.session = session.create_session(FETCH_WORKERS)
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=FETCH_WORKERS)
+        metrics.register('controller', self.collect_metrics)
+
         self.poly.onConfig(self.process_config)
 
     # Process changes to customParameters
@@ -79,9 +221,13 @@ class Controller(polyinterface.Controller):
         elif changed and valid:
             LOGGER.debug('-- configuration is valid')
             self.removeNoticesAll()
-            self.configured = True
-            if self.params.isSet('Forecast Days'):
-                self.discover()
+            self.apply_params()
+            if not self.configured:
+                self.configured = True
+                self.request_discover()
+                self.poller.request(True)
+            else:
+                self.reconfigure(self.params.changed)
         elif valid:
             LOGGER.debug('-- configuration not changed, but is valid')
 
@@ -92,47 +238,202 @@ class Controller(polyinterface.Controller):
         self.discover()
         LOGGER.info('Node server started')
 
+        # Show the last known values until the first query is done
+        self.restore_snapshot()
+
         # Do an initial query to get the data filled in as soon as possible
-        self.query_conditions(True)
+        self.poller.start()
+        self.poller.request(True)
 
+    # The query runs on the poll worker thread so that we don't block
+    # Polyglot's callback thread.  The quota manager decides if it's
+    # time to fetch new data.
+    #
+    # With interpolation, data is only fetched when the last data has
+    # expired, in between the current conditions are estimated from the
+    # hourly forecast.
     def shortPoll(self):
-        self.query_conditions(False)
-
-    # TODO: Move icon_2_int to a separate file
-    def icon_2_int(self, icn):
-        return {
-                'clear-day': 0,
-                'clear-night': 1,
-                'rain': 2,
-                'snow': 3,
-                'sleet': 4,
-                'wind': 5,
-                'fog': 6,
-                'cloudy': 7,
-                'partly-cloudy-day': 8,
-                'partly-cloudy-night': 9,
-                }.get(icn, 0)
-
-    def get_weather_data(self):
-        request = 'https://api.darksky.net/forecast/'
+        self.check_stale()
+        calls = len(self.get_locations())
+        fetch = self.quota.due(calls)
+        if fetch and self.interpolating():
+            fetch = self.interpolator.needs_fetch(time.time(), int(self.params.get('Cache TTL')))
+
+        if fetch:
+            self.poller.request(False)
+        elif self.interpolating():
+            self.poller.refresh()
+        else:
+            LOGGER.debug('Skipping poll, fetch interval is now %d seconds' % self.quota.interval(calls))
+
+    def longPoll(self):
+        self.check_stale()
+        LOGGER.info('Response cache: %d hits, %d misses (%.0f%% hit ratio)' %
+                (self.cache.hits, self.cache.misses, self.cache.hit_ratio() * 100))
+        LOGGER.info('API calls today: %d of %d' % (self.quota.calls, self.quota.budget))
+        for line in self.timer.report():
+            LOGGER.info('Poll timing: ' + line)
+
+    # Which of the data blocks do the enabled nodes actually use?
+    def get_blocks(self):
+        blocks = ['currently']
+        if int(self.params.get('Forecast Days')) > 0:
+            blocks.append('daily')
+        if self.get_hours() > 0 or self.interpolating():
+            blocks.append('hourly')
+        if self.params.get('Nowcast') == '1':
+            blocks.append('minutely')
+        if self.params.get('Alerts') == '1':
+            blocks.append('alerts')
+        return blocks
+
+    def get_hours(self):
+        return min(int(self.params.get('Forecast Hours')), MAX_HOURS)
+
+    def interpolating(self):
+        return self.params.get('Interpolate') == '1'
+
+    def get_locations(self):
+        locations = [l.strip() for l in self.params.get('Location').split(';') if l.strip() != '']
+        return locations[:MAX_LOCATIONS]
+
+    # Location 0 is handled by the controller itself, additional
+    # locations get their own current conditions node.
+    def current_address(self, loc):
+        if loc == 0:
+            return self.address
+        return 'current_' + str(loc)
+
+    def forecast_address(self, loc, day):
+        if loc == 0:
+            return 'forecast_' + str(day)
+        return 'forecast_' + str(loc) + '_' + str(day)
+
+    def nowcast_address(self, loc):
+        if loc == 0:
+            return 'nowcast'
+        return 'nowcast_' + str(loc)
+
+    def alerts_address(self, loc):
+        if loc == 0:
+            return 'alerts'
+        return 'alerts_' + str(loc)
+
+    def hourly_address(self, loc, hour):
+        if loc == 0:
+            return 'hourly_' + str(hour)
+        return 'hourly_' + str(loc) + '_' + str(hour)
+
+    # Number of hours of hourly data to keep from a response
+    def get_query_hours(self):
+        if self.interpolating():
+            return max(self.get_hours(), interpolate.HOURS)
+        return self.get_hours()
+
+    # What a poll asks for: (APIKey, locations, blocks, days, hours)
+    def query_signature(self):
+        return (self.params.get('APIKey'), tuple(self.get_locations()), frozenset(self.get_blocks()),
+                int(self.params.get('Forecast Days')), self.get_query_hours())
+
+    # Can the last responses be used for the current configuration?
+    # They can if they have at least all the data it needs.
+    def can_replay(self):
+        if self.last_results is None:
+            return False
+        (key, locations, blocks, days, hours) = self.query_signature()
+        (last_key, last_locations, last_blocks, last_days, last_hours) = self.last_query
+        return key == last_key and set(locations) <= set(last_locations) and blocks <= last_blocks and \
+                days <= last_days and hours <= last_hours
+
+    def get_weather_data(self, location):
+        blocks = self.get_blocks()
+        exclude = [b for b in BLOCKS if b not in blocks]
+        num_days = int(self.params.get('Forecast Days'))
+        num_hours = self.get_query_hours()
+
+        request = API_URL
         request += self.params.get('APIKey') + '/'
-        request += self.params.get('Location')
-        request += '?units=' + self.params.get('Units')
+        request += location
+        request += '?units=si'
+        if len(exclude) > 0:
+            request += '&exclude=' + ','.join(exclude)
 
-        #TODO: Can we set the number of days of forecast data?
+        key = cache.make_key(location, exclude, num_days, num_hours)
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.fetch_stats[location] = (None, 0, entry['fetched'])
+            metrics.FETCHES.inc('cached')
+            return entry['data']
 
+        if self.shared.enabled():
+            shared_key = shared_cache.make_key(location, exclude, num_days, num_hours)
+            fetch = lambda: self.fetch_shared(location, request, blocks, num_days, num_hours)
+            (entry, fetched) = self.shared.get(shared_key, fetch)
+            if entry is None:
+                return None
+            if not fetched:
+                self.fetch_stats[location] = (None, 0, entry['fetched'])
+                metrics.FETCHES.inc('shared')
+            elif 'error' not in entry['data']:
+                self.cache.put(key, entry['data'], self.fetch_headers.pop(location, None))
+            return entry['data']
+
+        (jdata, headers) = self.fetch_weather_data(location, request, blocks, num_days, num_hours)
+
+        # Don't cache error responses
+        if jdata is not None and 'error' not in jdata:
+            self.cache.put(key, jdata, headers)
+
+        return jdata
+
+    # Fetch for the shared cache, returns (data, lifetime).  The headers
+    # are kept for the local cache.
+    def fetch_shared(self, location, request, blocks, num_days, num_hours):
+        (jdata, headers) = self.fetch_weather_data(location, request, blocks, num_days, num_hours)
+        if jdata is None or 'error' in jdata:
+            return (jdata, None)
+        self.fetch_headers[location] = headers
+        lifetime = self.cache.ttl
+        from_headers = cache.header_lifetime(headers)
+        if from_headers is not None:
+            lifetime = min(lifetime, from_headers)
+        return (jdata, lifetime)
+
+    # Query the API, returns (data, headers) or (None, None) if the
+    # request failed.
+    def fetch_weather_data(self, location, request, blocks, num_days, num_hours):
         LOGGER.debug('request = %s' % request)
         try:
-            c = requests.get(request)
-            jdata = c.json()
+            c = session.get(self.session, request, stream=True)
+            self.timer.add('fetch', c.elapsed.total_seconds())
+            with self.timer.phase('download'):
+                content = c.content
+            headers = c.headers
             c.close()
-            LOGGER.debug(jdata)
+            self.quota.record(headers)
+            LOGGER.debug('response is %d bytes' % len(content))
+            with self.timer.phase('decode'):
+                jdata = c.json()
+                self.trim_response(jdata, num_days, num_hours)
+            fetched = None if 'error' in jdata else time.time()
+            self.fetch_stats[location] = (c.elapsed.total_seconds() * 1000, len(content), fetched)
+            metrics.FETCH_LATENCY.observe(c.elapsed.total_seconds())
+            metrics.FETCHES.inc('ok' if fetched else 'error')
+            del content
         except:
             LOGGER.error('HTTP request failed for api.darksky.net')
-            jdata = None
+            metrics.FETCHES.inc('failed')
+            return (None, None)
+
+        return (jdata, headers)
 
-        return jdata
 
+    # The excluded blocks are already left out of the response, only
+    # keep the forecast entries we use from the others.
+    def trim_response(self, jdata, num_days, num_hours):
+        for (block, count) in (('daily', num_days), ('hourly', num_hours)):
+            if block in jdata and 'data' in jdata[block]:
+                jdata[block]['data'] = jdata[block]['data'][:count]
 
     def query_conditions(self, force=False):
         # Query for the current conditions. We can do this fairly
@@ -144,93 +445,491 @@ class Controller(polyinterface.Controller):
             LOGGER.info('Skipping connection because we aren\'t configured yet.')
             return
 
+        self.apply_node_changes()
+        with self.timer.phase('poll'):
+            ok = self.profiler.run(self.poll_locations, force)
+
+        if ok:
+            self.failures = 0
+        else:
+            self.failures += 1
+        metrics.POLLS.inc('ok' if ok else 'failed')
+        self.update_poll_status()
+
+    # Returns True if every location was fetched and processed
+    def poll_locations(self, force):
+        # Fetch all locations at the same time, the total time is then
+        # about the time of the slowest fetch.
+        locations = self.get_locations()
+        query = self.query_signature()
+        self.fetch_stats = {}
         try:
-            jdata = self.get_weather_data()
-
-            if jdata == None:
-                LOGGER.error('Query returned no data')
-                return
-
-            for key in jdata:
-                LOGGER.debug('found key: ' + key)
-                #LOGGER.debug(jdata[key])
-
-            if 'error' in jdata:
-                LOGGER.error('DarkSky reports ' + jdata['error'])
-                self.addNotice(jdata['error'], 'error')
-                return
-
-            # Assume we always get the main section with data
-            # 'currently' is the current conditions
-            # 'daily' is the daily forecats
-
-            if 'currently' not in jdata:
-                LOGGER.error('No current condition object in query response.')
-                # Note that we're also going to skip forecast data now.
-                return
-
-            ob = jdata['currently']
-            self.update_driver('GV13', self.icon_2_int(ob['icon']), force)
-            self.update_driver('CLITEMP', ob['temperature'], force)
-            self.update_driver('CLIHUM', float(ob['humidity']) * 100, force)
-            self.update_driver('BARPRES', float(ob['pressure']), force)
-            self.update_driver('GV4', float(ob['windSpeed']), force)
-            self.update_driver('GV5', float(ob['windGust']), force)
-            self.update_driver('WINDDIR', float(ob['windBearing']), force)
-            self.update_driver('DISTANC', float(ob['visibility']), force)
-            self.update_driver('GV14', float(ob['cloudCover'] * 100), force)
-            self.update_driver('UV', float(ob['uvIndex']), force, prec=1)
-            self.update_driver('GV2', float(ob['apparentTemperature']), force)
-            self.update_driver('DEWPT', float(ob['dewPoint']), force)
-            self.update_driver('GV10', float(ob['ozone']), force)
-            self.update_driver('RAINRT', float(ob['precipIntensity']), force, prec=3)
-            self.update_driver('GV18', float(ob['precipProbability']) * 100, force)
-
-            # other possible data
-            # nearestStormDistance
-            # precipIntensityError
-            # precipType
-
-            # Daily data is 7 day forecast, index 0 is today
-            num_days = int(self.params.get('Forecast Days'))
-            LOGGER.debug('Process forecast data for ' + str(num_days) + ' days')
-            for day in range(0,num_days):
-                address = 'forecast_' + str(day)
-                LOGGER.debug('calling update_forecast for ' + address)
+            results = list(self.pool.map(self.get_weather_data, locations))
+        except:
+            LOGGER.error('Failed to query DarkSky.')
+            return False
+
+        # Each location gets its own transaction.  Any error while
+        # processing a location rolls back all of that location's
+        # updates, the other locations are still published.
+        ok = True
+        transactions = []
+        with self.timer.phase('update'):
+            for loc in range(0, len(locations)):
+                self.begin_poll()
                 try:
-                    self.nodes[address].update_forecast(jdata['daily']['data'][day], jdata['latitude'], self.params.get('Elevation'), self.params.get('Plant Type'), self.params.get('Units'), force)
+                    self.update_location(loc, results[loc], force)
                 except:
-                    LOGGER.debug('Failed to query forecast data for day ' + day)
+                    LOGGER.error('Failed to process data from DarkSky for ' + locations[loc])
+                    self.abort_poll()
+                    ok = False
+                    continue
+                transactions.append(self.transaction)
+                self.transaction = None
+        with self.timer.phase('publish'):
+            count = sum([t.commit() for t in transactions])
+            LOGGER.debug('Published %d driver updates' % count)
+        if not ok:
+            return False
+
+        jdata = results[0]
+        if jdata is not None and 'currently' in jdata:
+            self.data_time = float(jdata['currently'].get('time', time.time()))
+            self.check_stale()
+            snapshot.save(self.nodes, self.data_time, self.snapshot_key())
+            if self.history.enabled():
+                (values, missing) = mapping.CONDITIONS.extract(jdata['currently'])
+                self.history.append(self.data_time, values, 'si')
+
+        for jdata in results:
+            if jdata is None or 'error' in jdata:
+                return False
+
+        # Kept so that configuration changes can be applied without
+        # another query
+        self.last_query = query
+        self.last_results = dict(zip(locations, results))
+        return True
+
+    # Apply a configuration change.  Only the nodes that were added or
+    # removed change and, if the last responses have all the data that
+    # is needed, they're processed again instead of querying.  The nodes
+    # and their units are changed on the poll thread by the poll or
+    # refresh requested here, never while a poll is using them.
+    def reconfigure(self, changed):
+        LOGGER.info('Changed parameters: ' + ', '.join(changed))
+        if any([p in NODE_PARAMS for p in changed]):
+            self.request_discover()
+
+        if not any([p in REPLAY_PARAMS or p in ('APIKey', 'Interpolate') for p in changed]):
+            return
+        if self.can_replay():
+            with self.replay_lock:
+                self.replay_params.update(changed)
+            self.poller.refresh()
+        else:
+            self.poller.request(True)
+
+    # Have the poll thread add and remove nodes before its next poll or
+    # refresh.
+    def request_discover(self):
+        with self.replay_lock:
+            self.rediscover = True
+
+    # Runs on the poll thread before every poll and refresh.  Applies
+    # the node and unit changes of the configuration.
+    def apply_node_changes(self):
+        with self.replay_lock:
+            rediscover = self.rediscover
+            self.rediscover = False
+        if rediscover:
+            self.discover()
+        elif self.params.get('Units') != self.units:
+            self.set_driver_uom(self.params.get('Units'))
+
+    # Runs on the poll thread when there's no poll to do
+    def refresh(self):
+        self.apply_node_changes()
+        with self.replay_lock:
+            changed = self.replay_params
+            self.replay_params = set()
+        if len(changed) > 0:
+            self.replay(changed)
+        self.refresh_conditions()
+
+    # Process the last responses again for the changed parameters.
+    # Elevation and Plant Type only change the ETo values.
+    def replay(self, changed):
+        if not self.can_replay():
+            self.poller.request(True)
+            return
+        results = [self.last_results[l] for l in self.get_locations()]
+
+        replayed = [p for p in changed if p in REPLAY_PARAMS]
+        et_only = len(replayed) > 0 and all([p in ('Elevation', 'Plant Type') for p in replayed])
+        force = 'Units' in changed or et_only
+        LOGGER.info('Updating from the last %s' % ('responses' if len(results) > 1 else 'response'))
+        self.begin_poll()
+        try:
+            for loc in range(0, len(results)):
+                if et_only:
+                    self.update_et(loc, results[loc], force)
+                elif len(replayed) > 0:
+                    self.update_location(loc, results[loc], force)
+            if 'Interpolate' in changed:
+                self.replay_interpolate(results[0])
+        except:
+            LOGGER.error('Failed to process the last DarkSky data')
+            self.abort_poll()
+            return
+        self.commit_poll()
+        snapshot.save(self.nodes, self.data_time, self.snapshot_key())
+
+    # Interpolation was turned on or off.  Start interpolating from the
+    # last response, or go back to the observed current conditions.
+    def replay_interpolate(self, jdata):
+        ob = jdata['currently']
+        if self.interpolating():
+            self.interpolator.update(ob, jdata.get('hourly', {}).get('data', []), self.fetched_time(ob))
+        else:
+            self.update_conditions(ob, True)
+
+    # When the data of the first location was fetched from the API,
+    # which is earlier than now for a cached response.  Falls back to
+    # the observation time.
+    def fetched_time(self, ob):
+        stats = self.fetch_stats.get(self.get_locations()[0])
+        if stats is not None and stats[2] is not None:
+            return stats[2]
+        return float(ob.get('time', time.time()))
+
+    # Update the current conditions from the interpolated estimate
+    def refresh_conditions(self):
+        ob = self.interpolator.estimate(time.time())
+        if ob is None:
+            return
+
+        LOGGER.debug('Updating current conditions from the hourly forecast')
+        self.begin_poll()
+        try:
+            self.update_conditions(ob, False)
         except:
-            LOGGER.error('Failed to process data from DarkSky.')
-        
+            LOGGER.error('Failed to update interpolated conditions')
+            self.abort_poll()
+            return
+        self.commit_poll()
+
+    # Publish the poll health drivers: last fetch latency, payload
+    # size, consecutive failures and age of the (cached) data.
+    def update_poll_status(self):
+        stats = self.fetch_stats.values()
+        latencies = [s[0] for s in stats if s[0] is not None]
+        if len(latencies) > 0:
+            self.update_driver('GV21', max(latencies), prec=0)
+            self.update_driver('GV22', sum([s[1] for s in stats]), prec=0)
+        fetched = [s[2] for s in stats if s[2] is not None]
+        if len(fetched) > 0:
+            self.update_driver('GV24', time.time() - min(fetched), prec=0)
+        self.update_driver('GV23', self.failures, prec=0)
+
+    # Values for the metrics endpoint, read when it's scraped
+    def collect_metrics(self):
+        return [
+            ('cache_hits_total', 'counter', 'Responses served from the cache.', self.cache.hits),
+            ('cache_misses_total', 'counter', 'Responses not found in the cache.', self.cache.misses),
+            ('cache_hit_ratio', 'gauge', 'Fraction of responses served from the cache.', self.cache.hit_ratio()),
+            ('shared_cache_hits_total', 'counter', 'Responses fetched by another node server.', self.shared.hits),
+            ('api_calls_today', 'gauge', 'DarkSky API calls used today (UTC).', self.quota.calls),
+            ('api_daily_budget', 'gauge', 'DarkSky API calls allowed per day.', self.quota.budget),
+            ('consecutive_failures', 'gauge', 'Polls in a row that failed.', self.failures),
+            ('data_timestamp_seconds', 'gauge', 'Time of the current observation.', self.data_time),
+            ]
+
+    # The saved values are only good for the same locations and units
+    def snapshot_key(self):
+        return self.params.get('Location') + '|' + self.params.get('Units')
+
+    def restore_snapshot(self):
+        saved = snapshot.load(self.snapshot_key())
+        if saved is None:
+            return
+
+        (self.data_time, values) = saved
+        for address in values:
+            if address not in self.nodes:
+                continue
+            node = self.nodes[address]
+            for driver in values[address]:
+                try:
+                    node.publish_driver(driver, values[address][driver])
+                except:
+                    LOGGER.debug('Failed to restore %s for %s' % (driver, address))
+
+        LOGGER.info('Restored values from %d seconds ago' % (time.time() - self.data_time))
+        self.check_stale()
+
+    # Flag the data as stale when it is older than Max Data Age
+    def check_stale(self):
+        stale = (time.time() - self.data_time) > int(self.params.get('Max Data Age'))
+        if stale != self.stale:
+            if stale:
+                LOGGER.warning('Weather data is stale')
+            self.stale = stale
+            self.publish_driver('GV16', 1 if stale else 0)
+
+    def begin_poll(self):
+        self.transaction = node_funcs.PublishTransaction()
+
+    def commit_poll(self):
+        transaction = self.transaction
+        self.transaction = None
+        count = transaction.commit()
+        LOGGER.debug('Published %d driver updates' % count)
+
+    def abort_poll(self):
+        transaction = self.transaction
+        self.transaction = None
+        count = transaction.rollback()
+        LOGGER.warning('Discarded %d driver updates from failed poll' % count)
+
+    def update_location(self, loc, jdata, force):
+        if jdata == None:
+            LOGGER.error('Query returned no data')
+            return
+
+        for key in jdata:
+            LOGGER.debug('found key: ' + key)
+            #LOGGER.debug(jdata[key])
+
+        if 'error' in jdata:
+            LOGGER.error('DarkSky reports ' + jdata['error'])
+            self.addNotice(jdata['error'], 'error')
+            return
+
+        # Assume we always get the main section with data
+        # 'currently' is the current conditions
+        # 'daily' is the daily forecats
+
+        if 'currently' not in jdata:
+            LOGGER.error('No current condition object in query response.')
+            # Note that we're also going to skip forecast data now.
+            return
+
+        if loc == 0:
+            self.update_conditions(jdata['currently'], force)
+            self.quota.observe(jdata['currently'])
+            if self.interpolating():
+                self.interpolator.update(jdata['currently'], jdata.get('hourly', {}).get('data', []), self.fetched_time(jdata['currently']))
+            if STATS_ADDRESS in self.nodes:
+                self.nodes[STATS_ADDRESS].update_stats(jdata['currently'], force)
+        else:
+            self.nodes[self.current_address(loc)].update_conditions(jdata['currently'], force)
+
+        # Daily data is 7 day forecast, index 0 is today
+        num_days = int(self.params.get('Forecast Days'))
+        LOGGER.debug('Process forecast data for ' + str(num_days) + ' days')
+        for day in range(0,num_days):
+            address = self.forecast_address(loc, day)
+            LOGGER.debug('calling update_forecast for ' + address)
+            self.nodes[address].update_forecast(jdata['daily']['data'][day], jdata['latitude'], self.params.get('Elevation'), self.params.get('Plant Type'), force)
+
+        if self.get_hours() > 0:
+            self.update_hourly(loc, jdata, force)
+
+        address = self.nowcast_address(loc)
+        if address in self.nodes and 'minutely' in jdata:
+            self.nodes[address].update_nowcast(jdata['minutely'], force)
+
+        # There's no alerts block when there are no alerts
+        address = self.alerts_address(loc)
+        if address in self.nodes:
+            self.nodes[address].update_alerts(jdata.get('alerts', []), force)
+
+    # Hourly forecast, ETo for all the hours is calculated in one pass
+    def update_hourly(self, loc, jdata, force):
+        hours = jdata['hourly']['data'][:self.get_hours()]
+        LOGGER.debug('Process forecast data for ' + str(len(hours)) + ' hours')
+
+        et0 = self.hourly_et(jdata, hours)
+        offset = jdata.get('offset')
+        for hour in range(0, len(hours)):
+            address = self.hourly_address(loc, hour)
+            self.nodes[address].update_forecast(hours[hour], offset, et0[hour], force)
+
+    # Only the ETo values of a location
+    def update_et(self, loc, jdata, force):
+        num_days = int(self.params.get('Forecast Days'))
+        for day in range(0, num_days):
+            address = self.forecast_address(loc, day)
+            self.nodes[address].update_et(jdata['daily']['data'][day], jdata['latitude'], self.params.get('Elevation'), self.params.get('Plant Type'), force)
+
+        if self.get_hours() > 0:
+            hours = jdata['hourly']['data'][:self.get_hours()]
+            et0 = self.hourly_et(jdata, hours)
+            for hour in range(0, len(hours)):
+                self.nodes[self.hourly_address(loc, hour)].update_et(et0[hour], force)
+
+    # ETo in mm for each of the hours, None where it can't be calculated
+    def hourly_et(self, jdata, hours):
+        start = time.perf_counter()
+        try:
+            et0 = et3.evapotranspiration_hourly([float(h['temperature']) for h in hours],
+                    [float(h['humidity']) * 100 for h in hours],
+                    [float(h['windSpeed']) for h in hours],
+                    [float(h.get('cloudCover', 0)) for h in hours],
+                    float(self.params.get('Elevation')),
+                    float(jdata['latitude']), float(jdata['longitude']),
+                    float(self.params.get('Plant Type')),
+                    [float(h['time']) + 1800 for h in hours])
+        except (KeyError, TypeError, ValueError) as e:
+            LOGGER.warning('Unable to calculate hourly ETo: ' + str(e))
+            return [None] * len(hours)
+        self.timer.add('et', time.perf_counter() - start)
+        return [None if e is None else float(e) for e in et0]
+
+    update_conditions = darksky_current.update_conditions
+
     def query(self):
         for node in self.nodes:
             self.nodes[node].reportDrivers()
 
     def discover(self, *args, **kwargs):
-        # Create forecast nodes here.  We have up to 7 days.
+        # Create current condition nodes for each additional location
+        # and forecast nodes for each location.  We have up to 7 days.
+        # Only nodes that don't exist yet are added and only nodes that
+        # exist are removed.
         LOGGER.info("In Discovery...")
         num_days = int(self.params.get('Forecast Days'))
+        num_hours = self.get_hours()
+        nowcast = self.params.get('Nowcast') == '1'
+        alerts = self.params.get('Alerts') == '1'
+        num_locations = len(self.get_locations())
+        existing = set(self.nodes.keys())
 
-        if num_days < 7:
-            for day in range(num_days, 7):
-                address = 'forecast_' + str(day)
+        # Remove nodes for locations and days no longer configured
+        for loc in range(0, MAX_LOCATIONS):
+            address = self.current_address(loc)
+            if loc >= num_locations and loc > 0 and address in self.nodes:
                 try:
                     self.delNode(address)
                 except:
                     LOGGER.debug('Failed to delete node ' + address)
 
-        for day in range(0, num_days):
-            address = 'forecast_' + str(day)
-            title = 'Forecast ' + str(day)
+            start = num_days if loc < num_locations else 0
+            for day in range(start, 7):
+                address = self.forecast_address(loc, day)
+                if address in self.nodes:
+                    try:
+                        self.delNode(address)
+                    except:
+                        LOGGER.debug('Failed to delete node ' + address)
+
+            start = num_hours if loc < num_locations else 0
+            for hour in range(start, MAX_HOURS):
+                address = self.hourly_address(loc, hour)
+                if address in self.nodes:
+                    try:
+                        self.delNode(address)
+                    except:
+                        LOGGER.debug('Failed to delete node ' + address)
+
+            address = self.nowcast_address(loc)
+            if (loc >= num_locations or not nowcast) and address in self.nodes:
+                try:
+                    self.delNode(address)
+                except:
+                    LOGGER.debug('Failed to delete node ' + address)
+
+            address = self.alerts_address(loc)
+            if (loc >= num_locations or not alerts) and address in self.nodes:
+                try:
+                    self.delNode(address)
+                except:
+                    LOGGER.debug('Failed to delete node ' + address)
+
+        for loc in range(0, num_locations):
+            address = self.current_address(loc)
+            if loc > 0 and address not in self.nodes:
+                title = 'Location ' + str(loc)
+                try:
+                    node = darksky_current.CurrentNode(self, self.address, address, title)
+                    self.addNode(node);
+                except:
+                    LOGGER.error('Failed to create location node ' + title)
+
+            for day in range(0, num_days):
+                address = self.forecast_address(loc, day)
+                if address in self.nodes:
+                    continue
+                if loc == 0:
+                    title = 'Forecast ' + str(day)
+                else:
+                    title = 'Location ' + str(loc) + ' Forecast ' + str(day)
+                try:
+                    node = darksky_daily.DailyNode(self, self.address, address, title)
+                    self.addNode(node);
+                except:
+                    LOGGER.error('Failed to create forecast node' + title)
+
+            for hour in range(0, num_hours):
+                address = self.hourly_address(loc, hour)
+                if address in self.nodes:
+                    continue
+                if loc == 0:
+                    title = 'Hour ' + str(hour)
+                else:
+                    title = 'Location ' + str(loc) + ' Hour ' + str(hour)
+                try:
+                    node = darksky_hourly.HourlyNode(self, self.address, address, title)
+                    self.addNode(node)
+                except:
+                    LOGGER.error('Failed to create hourly forecast node ' + title)
+
+            address = self.nowcast_address(loc)
+            if nowcast and address not in self.nodes:
+                title = 'Nowcast' if loc == 0 else 'Location ' + str(loc) + ' Nowcast'
+                try:
+                    node = darksky_nowcast.NowcastNode(self, self.address, address, title)
+                    self.addNode(node)
+                except:
+                    LOGGER.error('Failed to create nowcast node ' + title)
+
+            address = self.alerts_address(loc)
+            if alerts and address not in self.nodes:
+                title = 'Alerts' if loc == 0 else 'Location ' + str(loc) + ' Alerts'
+                try:
+                    node = darksky_alerts.AlertsNode(self, self.address, address, title)
+                    self.addNode(node)
+                except:
+                    LOGGER.error('Failed to create alerts node ' + title)
+
+        # Rolling statistics for the first location
+        if self.params.get('Statistics') == '1':
+            if STATS_ADDRESS not in self.nodes:
+                try:
+                    node = darksky_stats.StatsNode(self, self.address, STATS_ADDRESS, 'Statistics')
+                    self.addNode(node)
+                except:
+                    LOGGER.error('Failed to create statistics node')
+        elif STATS_ADDRESS in self.nodes:
             try:
-                node = darksky_daily.DailyNode(self, self.address, address, title)
-                self.addNode(node);
+                self.delNode(STATS_ADDRESS)
             except:
-                LOGGER.error('Failed to create forecast node' + title)
+                LOGGER.debug('Failed to delete node ' + STATS_ADDRESS)
+
+        # Only new nodes need their units unless the units changed
+        units = self.params.get('Units')
+        if units != self.units:
+            self.set_driver_uom(units)
+        else:
+            for address in self.nodes:
+                if address not in existing:
+                    self.nodes[address].set_driver_uom(units)
 
-        self.set_driver_uom(self.params.get('Units'))
+    # The DISCOVER command, the nodes are changed on the poll thread
+    def discover_command(self, command):
+        self.request_discover()
+        self.poller.refresh()
 
     # Delete the node server from Polyglot
     def delete(self):
@@ -238,6 +937,11 @@ class Controller(polyinterface.Controller):
 
     def stop(self):
         LOGGER.info('Stopping node server')
+        metrics.unregister('controller')
+        self.poller.stop()
+        self.history.flush()
+        self.pool.shutdown(wait=False)
+        self.session.close()
 
     def update_profile(self, command):
         st = self.poly.installprofile()
@@ -249,21 +953,40 @@ class Controller(polyinterface.Controller):
         if self.params.get_from_polyglot(self):
             LOGGER.debug('All required parameters are set!')
             self.configured = True
+            self.apply_params()
+            if len(self.params.get('Location').split(';')) > MAX_LOCATIONS:
+                self.addNotice('Number of locations is limited to %d' % MAX_LOCATIONS, 'location')
             if int(self.params.get('Forecast Days')) > 7:
                 addNotice('Number of days of forecast data is limited to 7 days', 'forecast')
                 self.params.set('Forecast Days', 7)
+            if int(self.params.get('Forecast Hours')) > MAX_HOURS:
+                self.addNotice('Number of hours of forecast data is limited to %d' % MAX_HOURS, 'hours')
         else:
             LOGGER.debug('Configuration required.')
             LOGGER.debug('APIKey = ' + self.params.get('APIKey'))
             LOGGER.debug('Location = ' + self.params.get('Location'))
             self.params.send_notices(self)
 
+    # Configure the helpers that depend on parameter values
+    def apply_params(self):
+        self.cache.ttl = int(self.params.get('Cache TTL'))
+        self.shared.filename = self.params.get('Shared Cache').strip()
+        self.quota.budget = int(self.params.get('Daily Budget'))
+        self.history.max_size = int(float(self.params.get('History Size')) * 1024 * 1024)
+        if not self.interpolating():
+            self.interpolator.clear()
+        self.driver_filter.configure(self.params.get('Deadband'),
+                int(self.params.get('Min Publish Interval')),
+                int(self.params.get('Heartbeat')))
+
     def set_driver_uom(self, units):
         LOGGER.info('Configure driver units to ' + units)
+        self.units = units
         self.uom = uom.get_uom(units)
-        for day in range(0, int(self.params.get('Forecast Days'))):
-            address = 'forecast_' + str(day)
-            self.nodes[address].set_driver_uom(units)
+        self.converter = uom.get_converter(units)
+        for address in self.nodes:
+            if self.nodes[address] is not self:
+                self.nodes[address].set_driver_uom(units)
 
     def remove_notices_all(self, command):
         self.removeNoticesAll()
@@ -286,11 +1009,22 @@ class Controller(polyinterface.Controller):
         LOGGER.info('set_logging_level: Setting log level to %d' % level)
         LOGGER.setLevel(level)
 
+    # Profile the next N polls, the results are written to a file
+    def profile_cpu(self, command):
+        if self.profiler.request('cpu', command.get('value', 1)):
+            self.poller.request(False)
+
+    def profile_mem(self, command):
+        if self.profiler.request('mem', command.get('value', 1)):
+            self.poller.request(False)
+
     commands = {
-            'DISCOVER': discover,
+            'DISCOVER': discover_command,
             'UPDATE_PROFILE': update_profile,
             'REMOVE_NOTICES_ALL': remove_notices_all,
             'DEBUG': set_logging_level,
+            'PROFILE_CPU': profile_cpu,
+            'PROFILE_MEM': profile_mem,
             }
 
     # For this node server, all of the info is available in the single
@@ -301,20 +1035,11 @@ class Controller(polyinterface.Controller):
     #    SPEED   - speed / wind speed / gust speed
     drivers = [
             {'driver': 'ST', 'value': 1, 'uom': 2},   # node server status
-            {'driver': 'CLITEMP', 'value': 0, 'uom': 4},   # temperature
-            {'driver': 'GV2', 'value': 0, 'uom': 4},       # apparent temp
-            {'driver': 'CLIHUM', 'value': 0, 'uom': 22},   # humidity
-            {'driver': 'DEWPT', 'value': 0, 'uom': 4},     # dewpoint
-            {'driver': 'BARPRES', 'value': 0, 'uom': 117}, # pressure
-            {'driver': 'GV4', 'value': 0, 'uom': 49},      # wind speed
-            {'driver': 'WINDDIR', 'value': 0, 'uom': 76},  # direction
-            {'driver': 'GV5', 'value': 0, 'uom': 49},      # wind gust
-            {'driver': 'GV13', 'value': 0, 'uom': 25},     # climate conditions
-            {'driver': 'GV14', 'value': 0, 'uom': 22},     # cloud conditions
-            {'driver': 'DISTANC', 'value': 0, 'uom': 116}, # visibility
-            {'driver': 'GV18', 'value': 0, 'uom': 22},     # chance
-            {'driver': 'RAINRT', 'value': 0, 'uom': 24},   # rain
-            {'driver': 'UV', 'value': 0, 'uom': 71},       # UV index
-            {'driver': 'GV10', 'value': 0, 'uom': 56},     # Ozone
+            {'driver': 'GV16', 'value': 0, 'uom': 2}, # data is stale
+            ] + mapping.CONDITIONS.drivers() + [
+            {'driver': 'GV21', 'value': 0, 'uom': 42},     # fetch latency
+            {'driver': 'GV22', 'value': 0, 'uom': 56},     # payload bytes
+            {'driver': 'GV23', 'value': 0, 'uom': 56},     # consecutive failures
+            {'driver': 'GV24', 'value': 0, 'uom': 58},     # data age
             ]
 
@@ -0,0 +1,129 @@
+# Node definition for weather alerts
+#
+# Active alerts are kept in an index keyed on the alert (uri, or title
+# if there is no uri) and its expiry time, with a heap ordered by
+# expiry.  Each poll only adds new alerts and removes the ones that are
+# no longer reported, expired alerts come off the top of the heap.  The
+# number of alerts at each severity is kept as they come and go, so the
+# node values don't need a scan of the alerts.
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import heapq
+import time
+from nodes import uom
+import node_funcs
+
+LOGGER = polyinterface.LOGGER
+
+SEVERITY = {
+        'advisory': 1,
+        'watch': 2,
+        'warning': 3,
+        }
+
+NO_EXPIRY = -1
+
+
+def alert_key(alert):
+    return (alert.get('uri') or alert.get('title', ''), alert.get('expires'))
+
+
+class AlertIndex:
+    def __init__(self):
+        self.alerts = {}        # key -> severity
+        self.expiry = []        # heap of (expires, key)
+        self.counts = [0] * (max(SEVERITY.values()) + 1)
+
+    def __len__(self):
+        return len(self.alerts)
+
+    def add(self, key, severity):
+        self.alerts[key] = severity
+        self.counts[severity] += 1
+        if key[1] is not None:
+            heapq.heappush(self.expiry, (key[1], key))
+
+    # Heap entries of removed alerts are left in the heap and skipped
+    # when they reach the top.
+    def remove(self, key):
+        severity = self.alerts.pop(key, None)
+        if severity is not None:
+            self.counts[severity] -= 1
+
+    # Update from the alerts array of a response.  Returns True if the
+    # set of active alerts changed.
+    def update(self, alerts, now):
+        changed = False
+        seen = set()
+        for alert in alerts:
+            key = alert_key(alert)
+            if key[1] is not None and key[1] <= now:
+                continue
+            seen.add(key)
+            if key not in self.alerts:
+                self.add(key, SEVERITY.get(alert.get('severity', ''), 0))
+                changed = True
+
+        if len(seen) != len(self.alerts):
+            for key in [k for k in self.alerts if k not in seen]:
+                self.remove(key)
+            changed = True
+
+        return self.expire(now) or changed
+
+    # Drop alerts that have expired
+    def expire(self, now):
+        changed = False
+        while len(self.expiry) > 0 and self.expiry[0][0] <= now:
+            (expires, key) = heapq.heappop(self.expiry)
+            if key in self.alerts:
+                self.remove(key)
+                changed = True
+        return changed
+
+    def highest_severity(self):
+        for severity in range(len(self.counts) - 1, -1, -1):
+            if self.counts[severity] > 0:
+                return severity
+        return 0
+
+    # Time of the soonest expiry, or None
+    def next_expiry(self):
+        while len(self.expiry) > 0 and self.expiry[0][1] not in self.alerts:
+            heapq.heappop(self.expiry)
+        if len(self.expiry) == 0:
+            return None
+        return self.expiry[0][0]
+
+
+@node_funcs.add_functions_as_methods(node_funcs.functions)
+class AlertsNode(polyinterface.Node):
+    id = 'alerts'
+    index = None
+
+    def set_driver_uom(self, units):
+        self.uom = uom.get_uom(units)
+        self.units = units
+
+    def update_alerts(self, alerts, force):
+        if self.index is None:
+            self.index = AlertIndex()
+
+        now = time.time()
+        if self.index.update(alerts, now) or force:
+            LOGGER.info('%s: %d active alerts' % (self.address, len(self.index)))
+            self.update_driver('GV28', len(self.index), force, prec=0)
+            self.update_driver('GV29', self.index.highest_severity(), force, prec=0)
+
+        expires = self.index.next_expiry()
+        minutes = NO_EXPIRY if expires is None else (expires - now) / 60
+        self.update_driver('GV30', minutes, force, prec=0)
+
+    drivers = [
+            {'driver': 'GV28', 'value': 0, 'uom': 56},            # active alerts
+            {'driver': 'GV29', 'value': 0, 'uom': 25},            # highest severity
+            {'driver': 'GV30', 'value': NO_EXPIRY, 'uom': 45},    # minutes until the next expiry
+            ]
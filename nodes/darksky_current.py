@@ -0,0 +1,40 @@
+# Node definition for the current conditions at an additional location
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+from nodes import uom
+from nodes import mapping
+import node_funcs
+
+LOGGER = polyinterface.LOGGER
+
+
+# Update the current condition drivers from the 'currently' block.  This
+# is shared by the controller (first location) and the CurrentNode
+# (additional locations).
+def update_conditions(self, ob, force):
+    (values, missing) = mapping.CONDITIONS.extract(ob)
+    for (driver, value, prec) in self.converter.convert(values):
+        self.update_driver(driver, value, force, prec)
+    for driver in missing:
+        LOGGER.warning('Missing data for driver ' + driver)
+
+    # other possible data
+    # nearestStormDistance
+    # precipIntensityError
+    # precipType
+
+
+@node_funcs.add_functions_as_methods(node_funcs.functions)
+class CurrentNode(polyinterface.Node):
+    id = 'current'
+    drivers = mapping.CONDITIONS.drivers()
+
+    def set_driver_uom(self, units):
+        self.uom = uom.get_uom(units)
+        self.converter = uom.get_converter(units)
+        self.units = units
+
+    update_conditions = update_conditions
@@ -0,0 +1,46 @@
+# Node definition for an hourly forecast node
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import time
+from nodes import uom
+from nodes import mapping
+import node_funcs
+
+LOGGER = polyinterface.LOGGER
+
+@node_funcs.add_functions_as_methods(node_funcs.functions)
+class HourlyNode(polyinterface.Node):
+    id = 'hourly'
+    drivers = mapping.HOURLY.drivers()
+
+    def set_driver_uom(self, units):
+        self.uom = uom.get_uom(units)
+        self.converter = uom.get_converter(units)
+        self.units = units
+
+    # jdata is one entry of the hourly block (SI units), offset is the
+    # location's UTC offset in hours and et0 the ETo for the hour in mm.
+    # The ETo for all the hours is calculated in one batch by the
+    # controller.
+    def update_forecast(self, jdata, offset, et0, force):
+        (values, missing) = mapping.HOURLY.extract(jdata)
+        for (driver, value, prec) in self.converter.convert(values):
+            self.update_driver(driver, value, force, prec)
+        for driver in missing:
+            LOGGER.warning('Missing data for driver ' + driver)
+
+        if offset is None:
+            hour = time.localtime(int(jdata['time'])).tm_hour
+        else:
+            hour = time.gmtime(int(jdata['time'] + offset * 3600)).tm_hour
+        self.update_driver('GV15', hour, force, prec=0)
+        self.update_et(et0, force)
+
+    def update_et(self, et0, force):
+        if et0 is None:
+            return
+        (value, prec) = self.converter.value('GV25', et0, 3)
+        self.update_driver('GV25', value, force, prec)
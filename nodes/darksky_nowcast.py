@@ -0,0 +1,86 @@
+# Node definition for the minute by minute precipitation nowcast
+#
+# Summarizes the minutely block (the next hour) in a single pass:
+# minutes until precipitation starts or stops, peak intensity and the
+# expected accumulation (intensity weighted by probability).
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+from nodes import uom
+import node_funcs
+
+LOGGER = polyinterface.LOGGER
+
+# A minute counts as wet when both of these are reached.  Intensity is
+# in mm/hr.
+MIN_INTENSITY = 0.1
+MIN_PROBABILITY = 0.5
+
+# Published when it doesn't start / stop within the hour
+NOT_IN_HOUR = -1
+
+
+# Returns (start, stop, peak, total).  start is the minutes until it
+# starts (0 if wet now), stop the minutes until it stops (0 if dry now),
+# either is None if it doesn't happen within the data.  total is the
+# expected accumulation over the data in the intensity units * hours.
+def nowcast(data, min_intensity, min_probability=MIN_PROBABILITY):
+    start = None
+    stop = None
+    peak = 0.0
+    total = 0.0
+    wet_now = None
+
+    for minute, point in enumerate(data):
+        intensity = float(point.get('precipIntensity') or 0)
+        probability = float(point.get('precipProbability') or 0)
+        wet = intensity >= min_intensity and probability >= min_probability
+
+        if wet_now is None:
+            wet_now = wet
+            if wet:
+                start = 0
+            else:
+                stop = 0
+        elif wet and start is None:
+            start = minute
+        elif not wet and stop is None:
+            stop = minute
+
+        if intensity > peak:
+            peak = intensity
+        total += intensity * probability / 60.0
+
+    return (start, stop, peak, total)
+
+
+@node_funcs.add_functions_as_methods(node_funcs.functions)
+class NowcastNode(polyinterface.Node):
+    id = 'nowcast'
+
+    def set_driver_uom(self, units):
+        self.uom = uom.get_uom(units)
+        self.converter = uom.get_converter(units)
+        self.units = units
+
+    def update_nowcast(self, minutely, force):
+        data = minutely.get('data', [])
+        if len(data) == 0:
+            LOGGER.debug('No minutely data for ' + self.address)
+            return
+
+        (start, stop, peak, total) = nowcast(data, MIN_INTENSITY)
+
+        self.update_driver('GV26', NOT_IN_HOUR if start is None else start, force, prec=0)
+        self.update_driver('GV27', NOT_IN_HOUR if stop is None else stop, force, prec=0)
+        for (driver, value, prec) in self.converter.convert([('RAINRT', peak, 3), ('GV6', total, 3)]):
+            self.update_driver(driver, value, force, prec)
+
+    drivers = [
+            {'driver': 'GV26', 'value': NOT_IN_HOUR, 'uom': 45},  # minutes until it starts
+            {'driver': 'GV27', 'value': NOT_IN_HOUR, 'uom': 45},  # minutes until it stops
+            {'driver': 'RAINRT', 'value': 0, 'uom': 46},          # peak intensity
+            {'driver': 'GV6', 'value': 0, 'uom': 82},             # expected accumulation
+            ]
@@ -0,0 +1,194 @@
+# Node definition for rolling statistics of the current conditions
+#
+# Each new observation from the 'currently' block is added to a fixed
+# size ring buffer and the 24 hour high/low/average temperature, 3 hour
+# pressure trend and 24 hour rain total are kept up to date as samples
+# enter and leave the window, without rescanning the history.
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import array
+import collections
+import math
+import threading
+from nodes import uom
+import node_funcs
+
+LOGGER = polyinterface.LOGGER
+
+HISTORY_SIZE = 2880         # samples, 24 hours at one poll per 30 seconds
+WINDOW = 24 * 3600          # seconds
+TREND_WINDOW = 3 * 3600     # seconds
+MAX_GAP = 3600              # don't integrate rain over longer gaps than this
+
+NAN = float('nan')
+
+
+class RollingWindow:
+    def __init__(self, size=HISTORY_SIZE, window=WINDOW, trend_window=TREND_WINDOW):
+        self.size = size
+        self.window = window
+        self.trend_window = trend_window
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        zeros = bytes(8 * self.size)
+        self.times = array.array('d', zeros)
+        self.temps = array.array('d', zeros)
+        self.pressures = array.array('d', zeros)
+        self.rates = array.array('d', zeros)
+        self.rain = array.array('d', zeros)     # accumulated since previous sample
+
+        # Samples are numbered, sample n is in slot n % size.  The
+        # window holds samples tail .. head - 1.
+        self.head = 0
+        self.tail = 0
+        self.trend_tail = 0
+
+        # Sample numbers with increasing / decreasing temperatures, the
+        # first is the window's min / max.
+        self.min_q = collections.deque()
+        self.max_q = collections.deque()
+        self.temp_sum = 0.0
+        self.rain_sum = 0.0
+
+    def __len__(self):
+        return self.head - self.tail
+
+    def last_time(self):
+        if self.head == self.tail:
+            return None
+        return self.times[(self.head - 1) % self.size]
+
+    # Add an observation.  Returns False if it's not newer than the
+    # last one (a cached response).
+    def add(self, t, temp, pressure, rate):
+        with self.lock:
+            last = self.last_time()
+            if last is not None and t <= last:
+                return False
+
+            rain = 0.0
+            if last is not None:
+                prev_rate = self.rates[(self.head - 1) % self.size]
+                dt = min(t - last, MAX_GAP)
+                rain = (prev_rate + rate) / 2.0 * dt / 3600.0
+
+            if self.head - self.tail == self.size:
+                self.evict()
+
+            n = self.head
+            i = n % self.size
+            self.times[i] = t
+            self.temps[i] = temp
+            self.pressures[i] = pressure
+            self.rates[i] = rate
+            self.rain[i] = rain
+            self.head += 1
+
+            self.temp_sum += temp
+            self.rain_sum += rain
+            while len(self.min_q) > 0 and self.temps[self.min_q[-1] % self.size] >= temp:
+                self.min_q.pop()
+            self.min_q.append(n)
+            while len(self.max_q) > 0 and self.temps[self.max_q[-1] % self.size] <= temp:
+                self.max_q.pop()
+            self.max_q.append(n)
+
+            # Drop samples that are now outside the window
+            while self.times[self.tail % self.size] < t - self.window:
+                self.evict()
+            self.trend_tail = max(self.trend_tail, self.tail)
+            while self.times[self.trend_tail % self.size] < t - self.trend_window:
+                self.trend_tail += 1
+            return True
+
+    def evict(self):
+        n = self.tail
+        i = n % self.size
+        self.temp_sum -= self.temps[i]
+        self.rain_sum -= self.rain[i]
+        if len(self.min_q) > 0 and self.min_q[0] == n:
+            self.min_q.popleft()
+        if len(self.max_q) > 0 and self.max_q[0] == n:
+            self.max_q.popleft()
+        self.tail += 1
+
+    # (min, max, mean) temperature over the window
+    def temperature(self):
+        with self.lock:
+            if self.head == self.tail:
+                return None
+            return (self.temps[self.min_q[0] % self.size],
+                    self.temps[self.max_q[0] % self.size],
+                    self.temp_sum / (self.head - self.tail))
+
+    # Pressure change over the trend window, or None if there's no
+    # earlier sample.
+    def pressure_trend(self):
+        with self.lock:
+            first = self.pressures[self.trend_tail % self.size]
+            last = self.pressures[(self.head - 1) % self.size]
+            if self.head - self.trend_tail < 2 or math.isnan(first) or math.isnan(last):
+                return None
+            return last - first
+
+    # Rain accumulated over the window
+    def rain_total(self):
+        with self.lock:
+            return max(0.0, self.rain_sum)
+
+
+@node_funcs.add_functions_as_methods(node_funcs.functions)
+class StatsNode(polyinterface.Node):
+    id = 'stats'
+    history = None
+
+    # The history is kept in SI units, only the published values are
+    # converted.
+    def set_driver_uom(self, units):
+        self.uom = uom.get_uom(units)
+        self.converter = uom.get_converter(units)
+        self.units = units
+
+    # Add the latest 'currently' observation to the history and update
+    # the statistics.
+    def update_stats(self, ob, force=False):
+        if self.history is None:
+            self.history = RollingWindow()
+
+        try:
+            t = float(ob['time'])
+            temp = float(ob['temperature'])
+        except (KeyError, TypeError, ValueError):
+            LOGGER.warning('Missing time or temperature, not added to statistics')
+            return
+
+        pressure = ob.get('pressure')
+        pressure = NAN if pressure is None else float(pressure)
+        rate = float(ob.get('precipIntensity') or 0)
+
+        if not self.history.add(t, temp, pressure, rate) and not force:
+            return
+
+        (low, high, mean) = self.history.temperature()
+        values = [('GV0', high, 1), ('GV1', low, 1), ('GV3', mean, 1)]
+
+        trend = self.history.pressure_trend()
+        if trend is not None:
+            values.append(('BARPRES', trend, 2))
+
+        values.append(('GV6', self.history.rain_total(), 3))
+        for (driver, value, prec) in self.converter.convert(values):
+            self.update_driver(driver, value, force, prec)
+
+    drivers = [
+            {'driver': 'GV0', 'value': 0, 'uom': 4},      # 24 hour high
+            {'driver': 'GV1', 'value': 0, 'uom': 4},      # 24 hour low
+            {'driver': 'GV3', 'value': 0, 'uom': 4},      # 24 hour average
+            {'driver': 'BARPRES', 'value': 0, 'uom': 117},  # 3 hour pressure change
+            {'driver': 'GV6', 'value': 0, 'uom': 82},     # 24 hour rain
+            ]
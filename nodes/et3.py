@@ -4,7 +4,14 @@
 # Evapotranspiration (FAO-56 Methos)
 # http://edis.ifas.ufl.edu/pdffiles/ae/ae45900.pdf
 
+import collections
+import datetime
 import math
+import threading
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # Formulas and constants
 vaporRate = 237.3
@@ -22,7 +29,7 @@ def w2mj (watt):  # watts/m2 to megajoul/m2
     return watt * 0.0864
 
 def mph2ms (mph): # MPH to m/s
-    return mph * 0.477
+    return mph * 0.447
 
 def deg2rad(deg):
     return math.pi / 180 * deg
@@ -84,8 +91,9 @@ def long_wave_radiation(min_t, max_t, vp, sr, clear_sky):
     rel4 = 1.35 * sr / clear_sky - 0.35;
     return rel1 * rel2 * rel3 * rel4;
 
-# calculate the approx. solar radiation  in mega-joules/m2
-def calc_solar_radiation(t_min, t_max, lat, declination, julian_day):
+# approx. extraterrestrial radiation used to estimate solar radiation
+# when no measurement is available.
+def estimated_extraterrestrial_radiation(lat, declination, julian_day):
 
     Dr = 1.0 + 0.033 * math.cos(2 * math.pi / 365 * julian_day)
 
@@ -97,95 +105,164 @@ def calc_solar_radiation(t_min, t_max, lat, declination, julian_day):
 
     omega = math.acos(omega_pre)
 
-    Ra = 24.0 / math.pi * 4.92 * Dr * (omega * math.sin(lat) * math.sin(declination) + math.cos(lat) * math.cos(declination) * math.sin(omega))
+    return 24.0 / math.pi * 4.92 * Dr * (omega * math.sin(lat) * math.sin(declination) + math.cos(lat) * math.cos(declination) * math.sin(omega))
+
+# calculate the approx. solar radiation  in mega-joules/m2
+def calc_solar_radiation(t_min, t_max, lat, declination, julian_day):
+
+    Ra = estimated_extraterrestrial_radiation(lat, declination, julian_day)
 
     Rs = 0.17 * math.sqrt(t_max - t_min) * Ra
 
     return Rs
-    
 
-# temperature in C
-# elevation in meters
-# latitude in degrees
-# avg_ws in m/s
-# solar_radiation in W/m2
-def evapotranspriation(max_t, min_t, solar_radiation, avg_ws, elevation, max_h, min_h, latitude, canopy_coefficient, day):
 
-    julian_day = day
+# The parts of the calculation that depend only on the day of the year
+# and the latitude (steps 12 - 15).  Returns the extraterrestrial
+# radiation and the estimate used for solar radiation.  The sunset hour
+# angle is undefined for polar day/night, in that case Ra is NaN.
+def astronomy(latitude, julian_day):
+    # step 12.1, relative sun earth distance
+    dist = relative_earth_sun_distance(julian_day)
+
+    # step 12.2, solar declination
+    declination = solar_declination(julian_day)
 
+    # step 13, latitude in radians
+    latitude_r = deg2rad(latitude)
+
+    Ra_est = estimated_extraterrestrial_radiation(latitude_r, declination, julian_day)
+
+    try:
+        # step 14, sunset hour angle
+        angle = sunset_hour_angle(latitude_r, declination)
+
+        # step 15, extraerrestrial radiation
+        Ra = extraterrestrial_radiation(dist, angle, latitude_r, declination)
+    except ValueError:
+        Ra = float('nan')
+
+    return (Ra, Ra_est)
+
+
+# Table of astronomy() results for every day of the year at one latitude.
+class AstroTable:
+    def __init__(self, latitude):
+        self.latitude = latitude
+        self.ra = []
+        self.ra_est = []
+        for day in range(1, 367):
+            (Ra, Ra_est) = astronomy(latitude, day)
+            self.ra.append(Ra)
+            self.ra_est.append(Ra_est)
+
+        if numpy is not None:
+            self.ra_array = numpy.array(self.ra)
+            self.ra_est_array = numpy.array(self.ra_est)
+
+    def lookup(self, julian_day):
+        return (self.ra[julian_day - 1], self.ra_est[julian_day - 1])
+
+
+# Tables are kept for the most recently used latitudes.
+ASTRO_TABLES = 16
+_astro_tables = collections.OrderedDict()
+_astro_lock = threading.Lock()
+
+def astro_table(latitude):
+    latitude = float(latitude)
+    with _astro_lock:
+        table = _astro_tables.get(latitude)
+        if table is not None:
+            _astro_tables.move_to_end(latitude)
+            return table
+
+    table = AstroTable(latitude)
+
+    with _astro_lock:
+        _astro_tables[latitude] = table
+        while len(_astro_tables) > ASTRO_TABLES:
+            _astro_tables.popitem(last=False)
+    return table
+
+
+# Math functions used by _et0() for scalar values.  These use the
+# numpy names so that the same code can run on numpy arrays.
+class _ScalarMath:
+    exp = staticmethod(math.exp)
+    sqrt = staticmethod(math.sqrt)
+    sin = staticmethod(math.sin)
+    cos = staticmethod(math.cos)
+    tan = staticmethod(math.tan)
+    arccos = staticmethod(math.acos)
+    maximum = staticmethod(max)
+
+    @staticmethod
+    def clip(x, low, high):
+        return min(max(x, low), high)
+
+    @staticmethod
+    def where(condition, a, b):
+        return a if condition else b
+
+
+# FAO-56 ET0 for either scalars (xp = _ScalarMath) or numpy arrays
+# (xp = numpy).  This is the same step by step calculation as the
+# individual functions above, written once so that both paths share it.
+# Ra and Ra_est come from the astronomy tables.
+def _et0(xp, max_t, min_t, solar_radiation, avg_ws, elevation, max_h, min_h, canopy_coefficient, Ra, Ra_est):
     # step 1, mean daily air temperature C
     mean_daily_temp = (max_t + min_t) / 2.0
 
-    # step 2, mean solar radiation in mgajoules / m2
-    #Rs = w2mj(solar_radiation)
-
     # step 4, slope of saturation vapor pressure curve
-    vp_slope = saturation_vapor_pressure_curve_slope(mean_daily_temp)
+    sv_mean = 0.6108 * xp.exp((enthalpy * mean_daily_temp) / (mean_daily_temp + vaporRate))
+    vp_slope = 4098 * sv_mean / ((mean_daily_temp + vaporRate) ** 2)
 
     # step 5, atmospheric pressure
-    pressure = atmospheric_pressure(elevation)
+    pressure = 101.3 * ((293 - 0.0065 * elevation) / 293) ** 5.26
 
     # step 6, psychrometric constant
-    psychrometric = psychrometric_constant(pressure)
+    psychrometric = 0.000665 * pressure
 
-    # step 7, delta term
-    delta = delta_term(vp_slope, psychrometric, avg_ws)
-
-    # step 8, psi term
-    psi = psi_term(vp_slope, psychrometric, avg_ws)
+    # step 7, delta term and step 8, psi term
+    bottom = vp_slope + psychrometric * (1 + 0.34 * avg_ws)
+    delta = vp_slope / bottom
+    psi = psychrometric / bottom
 
     # step 9, temperature term
-    t_term = temperature_term(mean_daily_temp, avg_ws)
+    t_term = 900 / (mean_daily_temp + kelvin) * avg_ws
 
     # step 10, mean saturation vapor pressure curve
-    vp_curve = (saturation_vapor(max_t) + saturation_vapor(min_t)) / 2
+    sv_max = 0.6108 * xp.exp((enthalpy * max_t) / (max_t + vaporRate))
+    sv_min = 0.6108 * xp.exp((enthalpy * min_t) / (min_t + vaporRate))
+    vp_curve = (sv_max + sv_min) / 2
 
     # step 11, actual vapor pressure
-    vp_actual = saturation_vapor_pressure_actual(min_t, max_t, min_h, max_h)
-
-    # step 11.1, vapor pressure deficit
-    vp_deficit = vp_curve - vp_actual
-
-    # step 12.1, relative sun earth distance
-    dist = relative_earth_sun_distance(julian_day)
-
-    # step 12.2, solar declination
-    declination = solar_declination(julian_day)
+    vp_actual = (sv_min * (max_h / 100) + sv_max * (min_h / 100)) / 2
 
-    # step 13, latitude in radians
-    latitude_r = deg2rad(latitude)
+    # steps 12 - 15 are in the astronomy tables
 
-    ## Testing solar radiation calculation
     if solar_radiation is None:
-        Rs = calc_solar_radiation(min_t, max_t, latitude_r, declination, julian_day)
+        Rs = 0.17 * xp.sqrt(max_t - min_t) * Ra_est
     else:
-        Rs = w2mj(solar_radiation)
-
-    # step 14, sunset hour angle
-    angle = sunset_hour_angle(latitude_r, declination)
-
-    # step 15, extraerrestrial radiation
-    Ra = extraterrestrial_radiation(dist, angle, latitude_r, declination)
+        Rs = solar_radiation * 0.0864
 
     # step 16, clear sky solar radiation
-    Rso = clear_sky_solar_radiation(elevation, Ra)
+    Rso = (0.75 + 2e-5 * elevation) * Ra
 
     # step 17, net solar radiation
     Rns = (1 - canopy_coefficient) * Rs
 
     # step 18, net outgoing long wave solar radiation
-    Rnl = long_wave_radiation(min_t, max_t, vp_actual, Rs, Rso)
+    Rnl = 4.903e-9 * (((max_t + kelvin) ** 4 + (min_t + kelvin) ** 4) / 2) * \
+            (0.34 - 0.14 * xp.sqrt(vp_actual)) * (1.35 * Rs / Rso - 0.35)
 
-    # step 19, net radiation
-    Rn = Rns - Rnl
-
-    # step 19.1, net radiation in mm
-    Rng = Rn * 0.408
+    # step 19, net radiation, 19.1 in mm
+    Rng = (Rns - Rnl) * 0.408
 
     # step FS1, radiation term ETrad
     radiation_term = delta * Rng
 
-
     # step FS2, wind term ETwind
     wind_term = psi * t_term * (vp_curve - vp_actual)
 
@@ -193,6 +270,190 @@ def evapotranspriation(max_t, min_t, solar_radiation, avg_ws, elevation, max_h,
     return radiation_term + wind_term
 
 
+# Broadcast scalars and sequences to a common length for the pure
+# python path.
+def _broadcast(args):
+    size = 1
+    for a in args:
+        if isinstance(a, (list, tuple)):
+            if size != 1 and len(a) not in (1, size):
+                raise ValueError('batch arguments have mismatched lengths')
+            size = max(size, len(a))
+
+    columns = []
+    for a in args:
+        if isinstance(a, (list, tuple)):
+            columns.append(a if len(a) == size else list(a) * size)
+        else:
+            columns.append([a] * size)
+    return columns
+
+
+# Look up Ra and Ra_est for arrays of latitudes and days, one table
+# per distinct latitude.
+def _astro_arrays(latitude, day):
+    Ra = numpy.empty(day.shape)
+    Ra_est = numpy.empty(day.shape)
+    index = day.astype(int) - 1
+    for lat in numpy.unique(latitude):
+        table = astro_table(lat)
+        mask = latitude == lat
+        Ra[mask] = table.ra_array[index[mask]]
+        Ra_est[mask] = table.ra_est_array[index[mask]]
+    return (Ra, Ra_est)
+
+
+# Batch ET0.  Each argument may be a scalar or an array and they are
+# broadcast against each other, so a whole season of days, several
+# locations and several crop coefficients can be evaluated in a single
+# pass.  With numpy the result is an array of the broadcast shape,
+# without numpy the arguments must be scalars or flat sequences of the
+# same length and a list is returned.
+#
+# Units are the same as evapotranspriation() below, day is the day of
+# the year (1 - 366).
+def evapotranspiration_batch(max_t, min_t, avg_ws, elevation, max_h, min_h, latitude, canopy_coefficient, day, solar_radiation=None):
+    if numpy is not None:
+        args = [max_t, min_t, avg_ws, elevation, max_h, min_h, latitude, canopy_coefficient, day]
+        if solar_radiation is not None:
+            args.append(solar_radiation)
+        args = list(numpy.broadcast_arrays(*[numpy.asarray(a, dtype=float) for a in args]))
+        if solar_radiation is not None:
+            solar_radiation = args.pop()
+        (max_t, min_t, avg_ws, elevation, max_h, min_h, latitude, canopy_coefficient, day) = args
+        (Ra, Ra_est) = _astro_arrays(latitude, day)
+        with numpy.errstate(invalid='ignore'):
+            return _et0(numpy, max_t, min_t, solar_radiation, avg_ws, elevation, max_h, min_h, canopy_coefficient, Ra, Ra_est)
+
+    args = [max_t, min_t, avg_ws, elevation, max_h, min_h, latitude, canopy_coefficient, day, solar_radiation]
+    result = []
+    for (mx, mn, ws, el, hx, hn, lat, cc, d, sr) in zip(*_broadcast(args)):
+        (Ra, Ra_est) = astro_table(lat).lookup(int(d))
+        result.append(_et0(_ScalarMath, mx, mn, sr, ws, el, hx, hn, cc, Ra, Ra_est))
+    return result
+
+
+# Hourly FAO-56 ET0 (equation 53) for scalars or numpy arrays, in mm
+# for the hour centred on solar_hour (local apparent solar time, without
+# the seasonal correction).
+#
+# There's no solar radiation in the forecast, so it's estimated from
+# the cloud cover with the Angstrom formula (equation 35), taking the
+# relative sunshine duration as 1 - cloud cover.  The same ratio gives
+# Rs/Rso for the long wave radiation at night.  Negative values (dew)
+# are returned as 0.
+def _et0_hourly(xp, temp, humidity, avg_ws, cloud_cover, elevation, canopy_coefficient, latitude, day, solar_hour):
+    # saturation and actual vapor pressure, slope of the curve
+    es = 0.6108 * xp.exp((enthalpy * temp) / (temp + vaporRate))
+    ea = es * humidity / 100
+    vp_slope = 4098 * es / ((temp + vaporRate) ** 2)
+
+    # atmospheric pressure and psychrometric constant
+    pressure = 101.3 * ((293 - 0.0065 * elevation) / 293) ** 5.26
+    psychrometric = 0.000665 * pressure
+
+    # extraterrestrial radiation for the hour (equations 28 - 33)
+    lat = latitude * (math.pi / 180)
+    dr = 1 + 0.033 * xp.cos(2 * math.pi / 365 * day)
+    declination = 0.409 * xp.sin(2 * math.pi / 365 * day - 1.39)
+    sunset = xp.arccos(xp.clip(-xp.tan(lat) * xp.tan(declination), -1.0, 1.0))
+    b = 2 * math.pi * (day - 81) / 364
+    seasonal = 0.1645 * xp.sin(2 * b) - 0.1255 * xp.cos(b) - 0.025 * xp.sin(b)
+    omega = math.pi / 12 * (solar_hour + seasonal - 12)
+    omega1 = xp.clip(omega - math.pi / 24, -sunset, sunset)
+    omega2 = xp.clip(omega + math.pi / 24, -sunset, sunset)
+    Ra = 12 * 60 / math.pi * solarConstant * dr * \
+            ((omega2 - omega1) * xp.sin(lat) * xp.sin(declination) +
+             xp.cos(lat) * xp.cos(declination) * (xp.sin(omega2) - xp.sin(omega1)))
+
+    # solar radiation from the cloud cover and Rs/Rso
+    sunshine = 0.25 + 0.5 * (1 - cloud_cover)
+    Rs = sunshine * Ra
+    ratio = xp.clip(sunshine / (0.75 + 2e-5 * elevation), 0.0, 1.0)
+
+    # net radiation, hourly Stefan-Boltzmann constant
+    Rns = (1 - canopy_coefficient) * Rs
+    Rnl = 2.043e-10 * (temp + kelvin) ** 4 * (0.34 - 0.14 * xp.sqrt(ea)) * (1.35 * ratio - 0.35)
+    Rn = Rns - Rnl
+
+    # soil heat flux, day and night
+    G = xp.where(Ra > 0, 0.1 * Rn, 0.5 * Rn)
+
+    et0 = (0.408 * vp_slope * (Rn - G) + psychrometric * 37 / (temp + kelvin) * avg_ws * (es - ea)) / \
+            (vp_slope + psychrometric * (1 + 0.34 * avg_ws))
+    return xp.maximum(et0, 0.0)
+
+
+# Day of the year and hour of local solar time (from the longitude) of
+# a unix timestamp.
+def solar_time(timestamp, longitude):
+    t = datetime.datetime.utcfromtimestamp(timestamp + longitude * 240)
+    return (t.timetuple().tm_yday, t.hour + t.minute / 60.0 + t.second / 3600.0)
+
+
+# Batch hourly ET0 in mm for each hour of a forecast.  Arguments may be
+# scalars or arrays and are broadcast like evapotranspiration_batch().
+#
+# temperature in C
+# humidity in percent
+# avg_ws in m/s
+# cloud_cover 0 - 1
+# elevation in meters
+# latitude and longitude in degrees
+# timestamp is the unix time of the middle of the hour
+def evapotranspiration_hourly(temp, humidity, avg_ws, cloud_cover, elevation, latitude, longitude, canopy_coefficient, timestamp):
+    if numpy is not None:
+        args = [temp, humidity, avg_ws, cloud_cover, elevation, latitude, longitude, canopy_coefficient, timestamp]
+        args = list(numpy.broadcast_arrays(*[numpy.asarray(a, dtype=float) for a in args]))
+        (temp, humidity, avg_ws, cloud_cover, elevation, latitude, longitude, canopy_coefficient, timestamp) = args
+        local = timestamp + longitude * 240
+        date = numpy.floor(local / 86400).astype('datetime64[D]')
+        day = (date - date.astype('datetime64[Y]')).astype(int) + 1
+        solar_hour = (local % 86400) / 3600
+        return _et0_hourly(numpy, temp, humidity, avg_ws, cloud_cover, elevation, canopy_coefficient, latitude, day, solar_hour)
+
+    args = [temp, humidity, avg_ws, cloud_cover, elevation, latitude, longitude, canopy_coefficient, timestamp]
+    result = []
+    for (t, h, ws, cc, el, lat, lon, k, ts) in zip(*_broadcast(args)):
+        (day, solar_hour) = solar_time(ts, lon)
+        result.append(_et0_hourly(_ScalarMath, t, h, ws, cc, el, k, lat, day, solar_hour))
+    return result
+
+
+# temperature in C
+# elevation in meters
+# latitude in degrees
+# avg_ws in m/s
+# solar_radiation in W/m2
+def evapotranspriation(max_t, min_t, solar_radiation, avg_ws, elevation, max_h, min_h, latitude, canopy_coefficient, day):
+    (Ra, Ra_est) = astro_table(latitude).lookup(int(day))
+    if math.isnan(Ra):
+        raise ValueError('sunset hour angle is undefined at latitude %f on day %d' % (latitude, day))
+    return _et0(_ScalarMath, max_t, min_t, solar_radiation, avg_ws, elevation, max_h, min_h, canopy_coefficient, Ra, Ra_est)
+
+
+# Compare the table lookups with the formulas and time both.
+def benchmark(latitudes=(-45.0, 0.0, 36.82, 60.0), days=range(1, 367)):
+    import timeit
+
+    worst = 0.0
+    for lat in latitudes:
+        for day in days:
+            (Ra, Ra_est) = astronomy(lat, day)
+            (tRa, tRa_est) = astro_table(lat).lookup(day)
+            worst = max(worst, abs(Ra - tRa), abs(Ra_est - tRa_est))
+
+    def direct():
+        for day in days:
+            astronomy(36.82, day)
+
+    def table():
+        for day in days:
+            astro_table(36.82).lookup(day)
+
+    t_direct = min(timeit.repeat(direct, number=20, repeat=3))
+    t_table = min(timeit.repeat(table, number=20, repeat=3))
+    return (worst, t_direct, t_table)
 
 
 if __name__ == '__main__':
@@ -204,6 +465,11 @@ if __name__ == '__main__':
     et0 = evapotranspriation(27.3, 10.7, None, 1.3, 401.33, 91, 36, 36.82, 0.23, 289)
     print("et0 = ", et0)
 
+    # Table results must match the formulas to within 1e-12
+    (worst, t_direct, t_table) = benchmark()
+    print("astronomy table max difference = %g (%s)" % (worst, 'ok' if worst <= 1e-12 else 'FAILED'))
+    print("astronomy formulas %.3f ms, table %.3f ms, speedup %.1fx" % (t_direct * 1000, t_table * 1000, t_direct / t_table))
+
 
 
 
@@ -0,0 +1,234 @@
+#
+#  Observation history
+#
+#  Every new current conditions observation of the first location is
+#  appended to a binary file of fixed size records:
+#
+#    header  - magic, version, record size, units and the field names
+#    records - time (double) followed by one float per field, in
+#              SI units as received from DarkSky
+#
+#  Records are buffered and written in batches (no fsync), so a crash
+#  can lose the last few observations but the SD card isn't written
+#  on every poll.  When the file reaches half the size limit it is
+#  renamed to darksky_history.1.dat, replacing the previous one, and a
+#  new file is started, so at most about the size limit is used.
+#
+#  Queries memory map the files and binary search on the time, only
+#  the records in the requested range are read.
+#
+#    for (t, temp, rate) in store.query(start, end, ['CLITEMP', 'RAINRT']):
+#        ...
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from nodes import mapping
+
+LOGGER = polyinterface.LOGGER
+
+HISTORY_FILE = 'darksky_history.dat'
+OLD_HISTORY_FILE = 'darksky_history.1.dat'
+
+MAGIC = b'DSKH'
+VERSION = 1
+HEADER_SIZE = 512
+HEADER = struct.Struct('<4sHHH8s')
+
+# The current condition drivers, in the order they are stored
+FIELDS = tuple([d['driver'] for d in mapping.CONDITIONS.drivers()])
+
+FLUSH_RECORDS = 16          # write after this many records
+FLUSH_INTERVAL = 900        # or this many seconds
+
+NAN = float('nan')
+
+
+def record_struct(fields):
+    return struct.Struct('<d' + 'f' * len(fields))
+
+
+def make_header(units, fields):
+    names = ','.join(fields).encode('ascii')
+    header = HEADER.pack(MAGIC, VERSION, record_struct(fields).size, len(fields), units.encode('ascii')[:8]) + names
+    return header + bytes(HEADER_SIZE - len(header))
+
+
+# Returns (units, fields) from a file header or None if it's not a
+# history file.
+def read_header(data):
+    if len(data) < HEADER_SIZE:
+        return None
+    (magic, version, size, count, units) = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        return None
+    names = bytes(data[HEADER.size:HEADER_SIZE]).rstrip(b'\0').decode('ascii')
+    fields = tuple(names.split(',')) if names != '' else ()
+    if len(fields) != count or record_struct(fields).size != size:
+        return None
+    return (units.rstrip(b'\0').decode('ascii'), fields)
+
+
+class HistoryStore:
+    def __init__(self, max_size=0, filename=HISTORY_FILE, old_filename=OLD_HISTORY_FILE, fields=FIELDS):
+        self.max_size = max_size
+        self.filename = filename
+        self.old_filename = old_filename
+        self.fields = fields
+        self.record = record_struct(fields)
+        self.units = None
+        self.pending = []
+        self.last_time = None
+        self.last_flush = time.time()
+        self.lock = threading.Lock()
+
+    def enabled(self):
+        return self.max_size > 0
+
+    # Start a new file if the current one is for different units or
+    # fields.
+    def open(self, units):
+        self.units = units
+        self.last_time = None
+        try:
+            with open(self.filename, 'rb') as hf:
+                data = hf.read(HEADER_SIZE)
+                header = read_header(data)
+                if header == (units, self.fields):
+                    size = hf.seek(0, os.SEEK_END)
+                    count = (size - HEADER_SIZE) // self.record.size
+                    if count > 0:
+                        hf.seek(HEADER_SIZE + (count - 1) * self.record.size)
+                        self.last_time = self.record.unpack(hf.read(self.record.size))[0]
+                    return
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            LOGGER.warning('Failed to read history file: ' + str(e))
+
+        self.rollover()
+
+    def rollover(self):
+        try:
+            if os.path.exists(self.filename):
+                os.replace(self.filename, self.old_filename)
+            with open(self.filename, 'wb') as hf:
+                hf.write(make_header(self.units, self.fields))
+        except OSError as e:
+            LOGGER.error('Failed to start a new history file: ' + str(e))
+
+    # Add the driver values, [(driver, value, prec)], of an observation
+    # at time t.  Older or repeated observations are ignored.
+    def append(self, t, values, units):
+        if not self.enabled():
+            return
+        with self.lock:
+            if units != self.units:
+                self.flush_locked()
+                self.open(units)
+            if self.last_time is not None and t <= self.last_time:
+                return
+
+            row = dict([(driver, value) for (driver, value, prec) in values])
+            self.pending.append(self.record.pack(t, *[row.get(f, NAN) for f in self.fields]))
+            self.last_time = t
+
+            if len(self.pending) >= FLUSH_RECORDS or time.time() - self.last_flush >= FLUSH_INTERVAL:
+                self.flush_locked()
+
+    def flush(self):
+        with self.lock:
+            self.flush_locked()
+
+    def flush_locked(self):
+        self.last_flush = time.time()
+        if len(self.pending) == 0 or self.units is None:
+            return
+        try:
+            size = os.path.getsize(self.filename)
+            if size + len(self.pending) * self.record.size > self.max_size / 2:
+                self.rollover()
+            with open(self.filename, 'ab') as hf:
+                hf.write(b''.join(self.pending))
+            self.pending = []
+        except OSError as e:
+            LOGGER.error('Failed to write history: ' + str(e))
+            # Don't let the buffer grow without bound
+            if len(self.pending) > FLUSH_RECORDS * 16:
+                self.pending = self.pending[-FLUSH_RECORDS:]
+
+    # Yield (time, value, ...) for each record with start <= time < end,
+    # with the values of the given fields (default all of them).
+    def query(self, start, end, fields=None):
+        if fields is None:
+            fields = self.fields
+        with self.lock:
+            pending = list(self.pending)
+            units = self.units
+
+        last = None
+        for filename in (self.old_filename, self.filename):
+            for row in self.query_file(filename, start, end, fields, units):
+                last = row[0]
+                yield row
+
+        # Skip anything that was written while the files were read
+        index = self.field_index(self.fields, fields)
+        for data in pending:
+            row = self.record.unpack(data)
+            if start <= row[0] < end and (last is None or row[0] > last):
+                yield self.select(row, index)
+
+    def query_file(self, filename, start, end, fields, units):
+        try:
+            with open(filename, 'rb') as hf:
+                if os.fstat(hf.fileno()).st_size <= HEADER_SIZE:
+                    return
+                with mmap.mmap(hf.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    header = read_header(mm)
+                    if header is None or (units is not None and header[0] != units):
+                        return
+                    index = self.field_index(header[1], fields)
+                    record = record_struct(header[1])
+                    count = (len(mm) - HEADER_SIZE) // record.size
+
+                    # First record with time >= start
+                    lo = 0
+                    hi = count
+                    while lo < hi:
+                        mid = (lo + hi) // 2
+                        if record.unpack_from(mm, HEADER_SIZE + mid * record.size)[0] < start:
+                            lo = mid + 1
+                        else:
+                            hi = mid
+
+                    for i in range(lo, count):
+                        row = record.unpack_from(mm, HEADER_SIZE + i * record.size)
+                        if row[0] >= end:
+                            break
+                        yield self.select(row, index)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            LOGGER.warning('Failed to read history file %s: %s' % (filename, str(e)))
+
+    # Position of each requested field in a record, None if the file
+    # doesn't have it.
+    def field_index(self, file_fields, fields):
+        return [file_fields.index(f) + 1 if f in file_fields else None for f in fields]
+
+    def select(self, row, index):
+        values = [row[0]]
+        for i in index:
+            if i is None or math.isnan(row[i]):
+                values.append(None)
+            else:
+                values.append(row[i])
+        return tuple(values)
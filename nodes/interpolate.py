@@ -0,0 +1,124 @@
+#
+#  Interpolated current conditions
+#
+#  Between fetches, estimate the current conditions by interpolating
+#  from the last observation toward the hourly forecast.  The estimate
+#  starts at the observed value and moves linearly to the forecast for
+#  the next hour, then along the hourly forecast.
+#
+#  When new data is fetched, the estimate for the time of the new
+#  observation is compared with it and logged if they're too far
+#  apart.  Either way the estimate starts over from the new
+#  observation, so an off forecast only lasts until the next fetch.
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import bisect
+import threading
+
+LOGGER = polyinterface.LOGGER
+
+# Fields that change smoothly enough to interpolate.  Wind bearing and
+# the icon keep the observed value.
+FIELDS = ('temperature', 'apparentTemperature', 'humidity', 'dewPoint',
+          'pressure', 'windSpeed', 'windGust', 'cloudCover',
+          'precipProbability', 'precipIntensity', 'uvIndex', 'visibility',
+          'ozone')
+
+# How far the estimate may be from the observation before it counts
+# as diverged, in C and hPa.
+MAX_TEMPERATURE_ERROR = 2.0
+MAX_PRESSURE_ERROR = 1.5
+
+# Hours of hourly data kept for interpolation
+HOURS = 3
+
+
+class Interpolator:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.base = None
+        self.times = []
+        self.points = []
+        self.fetched = 0
+
+    # Start from a new observation and hourly forecast.  Returns True
+    # if the previous estimate had diverged from this observation.
+    def update(self, currently, hourly, fetched):
+        try:
+            t = float(currently['time'])
+        except (KeyError, TypeError, ValueError):
+            return False
+
+        with self.lock:
+            if self.base is not None and t <= self.times[0]:
+                # Same (cached) observation
+                return False
+
+            diverged = False
+            estimate = self.estimate_locked(t)
+            if estimate is not None:
+                diverged = self.compare(estimate, currently)
+
+            self.base = currently
+            self.times = [t]
+            self.points = [currently]
+            for point in hourly:
+                if float(point.get('time', 0)) > t:
+                    self.times.append(float(point['time']))
+                    self.points.append(point)
+            self.fetched = fetched
+            return diverged
+
+    def compare(self, estimate, currently):
+        try:
+            dt = abs(float(estimate['temperature']) - float(currently['temperature']))
+            dp = abs(float(estimate['pressure']) - float(currently['pressure']))
+        except (KeyError, TypeError, ValueError):
+            return False
+        if dt > MAX_TEMPERATURE_ERROR or dp > MAX_PRESSURE_ERROR:
+            LOGGER.info('Forecast diverged from observation: temperature %.1f, pressure %.1f' % (dt, dp))
+            return True
+        return False
+
+    # Does new data need to be fetched?  ttl is how long the data is
+    # used for.
+    def needs_fetch(self, now, ttl):
+        with self.lock:
+            return self.base is None or now - self.fetched >= ttl or \
+                    now > self.times[-1]
+
+    # The estimated 'currently' block at time now, or None if there's
+    # nothing to interpolate.
+    def estimate(self, now):
+        with self.lock:
+            return self.estimate_locked(now)
+
+    def estimate_locked(self, now):
+        if self.base is None or len(self.times) < 2 or now > self.times[-1]:
+            return None
+
+        i = bisect.bisect_right(self.times, now) - 1
+        if i < 0:
+            return None
+        if i == len(self.times) - 1:
+            i -= 1
+        (t0, t1) = (self.times[i], self.times[i + 1])
+        (p0, p1) = (self.points[i], self.points[i + 1])
+        f = (now - t0) / (t1 - t0)
+
+        ob = dict(self.base)
+        ob['time'] = now
+        for field in FIELDS:
+            try:
+                v0 = float(p0[field])
+                v1 = float(p1[field])
+            except (KeyError, TypeError, ValueError):
+                continue
+            ob[field] = v0 + (v1 - v0) * f
+        return ob
@@ -0,0 +1,150 @@
+#
+#  Driver mapping tables
+#
+#  Each node type has a table that lists, for every driver, where its
+#  value comes from in the DarkSky response and how to convert it.
+#  The node's driver list (and so the profile) is built from the same
+#  table.
+#
+#  Table entries:
+#    'driver'    : driver name
+#    'uom'       : default unit of measure
+#    'field'     : JSON field in the data block, None if the value is
+#                  calculated by the node
+#    'scale'     : multiply the field value by this (default 1)
+#    'prec'      : round to this many decimal places (default 3)
+#    'transform' : function applied to the field value instead of
+#                  scaling (default None)
+#    'default'   : value used if the field is missing, if there is no
+#                  default the driver isn't updated
+#    'value'     : initial driver value (default 0)
+
+import time
+
+ICONS = {
+        'clear-day': 0,
+        'clear-night': 1,
+        'rain': 2,
+        'snow': 3,
+        'sleet': 4,
+        'wind': 5,
+        'fog': 6,
+        'cloudy': 7,
+        'partly-cloudy-day': 8,
+        'partly-cloudy-night': 9,
+        }
+
+_MISSING = object()
+
+
+def icon_2_int(icn):
+    return ICONS.get(icn, 0)
+
+
+def day_of_week(epoch):
+    return int(time.strftime("%w", time.gmtime(int(epoch))))
+
+
+class DriverMap:
+    def __init__(self, table):
+        self.table = table
+
+        # Resolve the table once into a tuple of fixed-layout entries
+        # so that extract() does no dictionary lookups on the table.
+        entries = []
+        for t in table:
+            if t.get('field') is None:
+                continue
+            entries.append((
+                t['driver'],
+                t['field'],
+                float(t.get('scale', 1)),
+                t.get('prec', 3),
+                t.get('transform'),
+                t.get('default', _MISSING),
+                ))
+        self.entries = tuple(entries)
+
+    # The node class driver list
+    def drivers(self):
+        return [{'driver': t['driver'], 'value': t.get('value', 0), 'uom': t['uom']} for t in self.table]
+
+    # Return a list of (driver, value, prec) for the fields found in
+    # data and a list of drivers whose fields were missing.
+    def extract(self, data):
+        values = []
+        missing = []
+        for (driver, field, scale, prec, transform, default) in self.entries:
+            raw = data.get(field, default)
+            if raw is _MISSING or raw is None:
+                missing.append(driver)
+                continue
+            if transform is not None:
+                value = transform(raw)
+            else:
+                value = float(raw) * scale
+            values.append((driver, value, prec))
+        return (values, missing)
+
+
+# Current conditions, used by the controller and the current
+# conditions node.
+CONDITIONS = DriverMap([
+    {'driver': 'CLITEMP', 'uom': 4, 'field': 'temperature'},
+    {'driver': 'GV2', 'uom': 4, 'field': 'apparentTemperature'},
+    {'driver': 'CLIHUM', 'uom': 22, 'field': 'humidity', 'scale': 100},
+    {'driver': 'DEWPT', 'uom': 4, 'field': 'dewPoint'},
+    {'driver': 'BARPRES', 'uom': 117, 'field': 'pressure'},
+    {'driver': 'GV4', 'uom': 49, 'field': 'windSpeed'},
+    {'driver': 'WINDDIR', 'uom': 76, 'field': 'windBearing'},
+    {'driver': 'GV5', 'uom': 49, 'field': 'windGust'},
+    {'driver': 'GV13', 'uom': 25, 'field': 'icon', 'transform': icon_2_int},
+    {'driver': 'GV14', 'uom': 22, 'field': 'cloudCover', 'scale': 100},
+    {'driver': 'DISTANC', 'uom': 116, 'field': 'visibility'},
+    {'driver': 'GV18', 'uom': 22, 'field': 'precipProbability', 'scale': 100},
+    {'driver': 'RAINRT', 'uom': 24, 'field': 'precipIntensity', 'prec': 3},
+    {'driver': 'UV', 'uom': 71, 'field': 'uvIndex', 'prec': 1},
+    {'driver': 'GV10', 'uom': 56, 'field': 'ozone'},
+    ])
+
+# Daily forecast
+DAILY = DriverMap([
+    {'driver': 'GV19', 'uom': 25, 'field': 'time', 'transform': day_of_week},
+    {'driver': 'GV0', 'uom': 4, 'field': 'temperatureMax'},
+    {'driver': 'GV1', 'uom': 4, 'field': 'temperatureMin'},
+    {'driver': 'CLIHUM', 'uom': 22, 'field': 'humidity', 'scale': 100, 'prec': 0},
+    {'driver': 'DEWPT', 'uom': 4, 'field': 'dewPoint'},
+    {'driver': 'BARPRES', 'uom': 117, 'field': 'pressure'},
+    {'driver': 'GV13', 'uom': 25, 'field': 'icon', 'transform': icon_2_int},
+    {'driver': 'GV14', 'uom': 22, 'field': 'cloudCover', 'scale': 100, 'prec': 0},
+    {'driver': 'GV4', 'uom': 49, 'field': 'windSpeed'},
+    {'driver': 'GV5', 'uom': 49, 'field': 'windGust'},
+    {'driver': 'WINDDIR', 'uom': 76, 'field': 'windBearing'},
+    {'driver': 'GV7', 'uom': 82, 'field': 'precipAccumulation', 'scale': 10, 'default': 0},  # cm
+    {'driver': 'GV18', 'uom': 22, 'field': 'precipProbability', 'scale': 100},
+    {'driver': 'UV', 'uom': 71, 'field': 'uvIndex'},
+    {'driver': 'GV10', 'uom': 56, 'field': 'ozone'},
+    {'driver': 'DISTANC', 'uom': 83, 'field': 'visibility'},
+    {'driver': 'GV9', 'uom': 56, 'field': 'moonPhase'},
+    {'driver': 'GV20', 'uom': 106, 'field': None},       # ETo, calculated
+    ])
+
+# Hourly forecast
+HOURLY = DriverMap([
+    {'driver': 'GV19', 'uom': 25, 'field': 'time', 'transform': day_of_week},
+    {'driver': 'GV15', 'uom': 56, 'field': None},       # hour, calculated
+    {'driver': 'CLITEMP', 'uom': 4, 'field': 'temperature'},
+    {'driver': 'GV2', 'uom': 4, 'field': 'apparentTemperature'},
+    {'driver': 'CLIHUM', 'uom': 22, 'field': 'humidity', 'scale': 100, 'prec': 0},
+    {'driver': 'DEWPT', 'uom': 4, 'field': 'dewPoint'},
+    {'driver': 'BARPRES', 'uom': 117, 'field': 'pressure'},
+    {'driver': 'GV13', 'uom': 25, 'field': 'icon', 'transform': icon_2_int},
+    {'driver': 'GV14', 'uom': 22, 'field': 'cloudCover', 'scale': 100, 'prec': 0},
+    {'driver': 'GV4', 'uom': 49, 'field': 'windSpeed'},
+    {'driver': 'GV5', 'uom': 49, 'field': 'windGust'},
+    {'driver': 'WINDDIR', 'uom': 76, 'field': 'windBearing'},
+    {'driver': 'GV18', 'uom': 22, 'field': 'precipProbability', 'scale': 100},
+    {'driver': 'RAINRT', 'uom': 24, 'field': 'precipIntensity', 'prec': 3},
+    {'driver': 'UV', 'uom': 71, 'field': 'uvIndex'},
+    {'driver': 'GV25', 'uom': 46, 'field': None},       # hourly ETo, calculated
+    ])
@@ -0,0 +1,204 @@
+#
+#  Prometheus metrics
+#
+#  Counters and histograms that the poll code updates and an optional
+#  HTTP server that exposes them, along with values collected at scrape
+#  time (cache, API calls, memory), in the Prometheus text format.
+#
+#  The poll only ever increments a counter under a lock, everything
+#  else is done by the HTTP server thread when it's scraped.
+#
+#    curl http://127.0.0.1:9108/metrics
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import os
+import resource
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOGGER = polyinterface.LOGGER
+
+PREFIX = 'darksky_'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Fetch latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(names, values):
+    if len(names) == 0:
+        return ''
+    pairs = []
+    for (name, value) in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append('%s="%s"' % (name, value))
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s counter' % self.name]
+        with self.lock:
+            values = sorted(self.values.items())
+        for (labels, value) in values:
+            lines.append('%s%s %s' % (self.name, format_labels(self.labels, labels), value))
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, buckets):
+        self.name = PREFIX + name
+        self.help = help
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def samples(self):
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s histogram' % self.name]
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = 0
+        for (bound, count) in zip(self.buckets, counts):
+            cumulative += count
+            lines.append('%s_bucket{le="%s"} %d' % (self.name, bound, cumulative))
+        cumulative += counts[-1]
+        lines.append('%s_bucket{le="+Inf"} %d' % (self.name, cumulative))
+        lines.append('%s_sum %f' % (self.name, total))
+        lines.append('%s_count %d' % (self.name, cumulative))
+        return lines
+
+
+POLLS = Counter('polls_total', 'Polls run, by result.', ('result',))
+FETCHES = Counter('fetches_total', 'DarkSky API requests, by result.', ('result',))
+FETCH_LATENCY = Histogram('fetch_latency_seconds', 'DarkSky API request latency.', LATENCY_BUCKETS)
+PUBLISHES = Counter('publishes_total', 'Driver values sent to the ISY, by node.', ('node',))
+
+METRICS = [POLLS, FETCHES, FETCH_LATENCY, PUBLISHES]
+
+# name -> function returning [(metric, type, help, value)], called
+# when the endpoint is scraped.
+collectors = {}
+collectors_lock = threading.Lock()
+
+
+def register(name, collector):
+    with collectors_lock:
+        collectors[name] = collector
+
+
+def unregister(name):
+    with collectors_lock:
+        collectors.pop(name, None)
+
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        # Peak, not current, but the best we can do. ru_maxrss is
+        # KiB on Linux and bytes on macOS.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def process_samples():
+    return [('process_resident_memory_bytes', 'gauge', 'Resident memory size in bytes.', rss_bytes())]
+
+
+def render():
+    lines = []
+    for metric in METRICS:
+        lines += metric.samples()
+
+    with collectors_lock:
+        funcs = [process_samples] + list(collectors.values())
+    for func in funcs:
+        try:
+            samples = func()
+        except Exception as e:
+            LOGGER.warning('Metrics collector failed: ' + str(e))
+            continue
+        for (name, kind, help, value) in samples:
+            if not name.startswith('process_'):
+                name = PREFIX + name
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, kind))
+            lines.append('%s %s' % (name, value))
+
+    return '\n'.join(lines) + '\n'
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+# Start the metrics endpoint on a background thread.  Returns the
+# server or None if it couldn't be started.
+def start(port, address='127.0.0.1'):
+    try:
+        server = MetricsServer((address, port), Handler)
+    except OSError as e:
+        LOGGER.error('Failed to start metrics endpoint on %s:%d: %s' % (address, port, str(e)))
+        return None
+
+    thread = threading.Thread(target=server.serve_forever, name='Metrics')
+    thread.daemon = True
+    thread.start()
+    LOGGER.info('Metrics available at http://%s:%d/metrics' % server.server_address[:2])
+    return server
+
+
+# Start the endpoint if DARKSKY_METRICS_PORT is set in the environment
+def start_from_env():
+    port = os.environ.get('DARKSKY_METRICS_PORT')
+    if port is None or port == '':
+        return None
+    try:
+        port = int(port)
+    except ValueError:
+        LOGGER.error('Invalid DARKSKY_METRICS_PORT: ' + port)
+        return None
+    return start(port, os.environ.get('DARKSKY_METRICS_ADDRESS', '127.0.0.1'))
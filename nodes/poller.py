@@ -0,0 +1,90 @@
+#
+#  Background poll worker
+#
+#  Runs the poll function on its own thread so that shortPoll and the
+#  other Polyglot callbacks return immediately.  Only one poll runs at
+#  a time.  Requests that arrive while a poll is running are coalesced
+#  into a single follow-up poll, a forced request makes that follow-up
+#  poll forced.
+#
+#  An optional refresh function can also be run on the same thread, for
+#  updates that don't need a poll.  A pending poll replaces a pending
+#  refresh.
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import threading
+
+LOGGER = polyinterface.LOGGER
+
+
+class PollWorker:
+    def __init__(self, poll, refresh=None, name='PollWorker'):
+        self.poll = poll
+        self.refresh_func = refresh
+        self.name = name
+        self.condition = threading.Condition()
+        self.pending = False
+        self.refresh_pending = False
+        self.force = False
+        self.busy = False
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self.run, name=self.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    # Ask for a poll.  Returns immediately.
+    def request(self, force=False):
+        with self.condition:
+            if self.pending or self.busy:
+                LOGGER.debug('Poll already pending, coalescing request')
+            self.pending = True
+            self.force = self.force or force
+            self.condition.notify()
+
+    # Ask for a refresh.  Returns immediately.
+    def refresh(self):
+        if self.refresh_func is None:
+            return
+        with self.condition:
+            self.refresh_pending = True
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending and not self.refresh_pending:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                poll = self.pending
+                force = self.force
+                self.pending = False
+                self.refresh_pending = False
+                self.force = False
+                self.busy = True
+
+            try:
+                if poll:
+                    self.poll(force)
+                else:
+                    self.refresh_func()
+            except Exception as e:
+                LOGGER.error('Poll failed: ' + str(e))
+            finally:
+                with self.condition:
+                    self.busy = False
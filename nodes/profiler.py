@@ -0,0 +1,144 @@
+#
+#  On demand profiling
+#
+#  The PROFILE_CPU and PROFILE_MEM commands profile the next N polls
+#  with cProfile or tracemalloc and write the results to a file in the
+#  node server directory:
+#
+#    darksky_profile_cpu_<time>.txt  - functions sorted by cumulative time
+#    darksky_profile_mem_<time>.txt  - top allocation sites and growth
+#                                      over the profiled polls
+#
+#  cProfile only sees the poll thread, time spent waiting on the
+#  fetch threads shows up under concurrent.futures.
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import cProfile
+import io
+import pstats
+import threading
+import time
+import tracemalloc
+
+LOGGER = polyinterface.LOGGER
+
+MAX_CYCLES = 100
+TOP_FUNCTIONS = 60
+TOP_ALLOCATIONS = 40
+TRACE_FRAMES = 10
+
+
+class Profiler:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.kind = None
+        self.cycles = 0
+        self.done = 0
+        self.profile = None
+        self.baseline = None
+        self.started_tracing = False
+
+    # Profile the next 'cycles' polls, kind is 'cpu' or 'mem'
+    def request(self, kind, cycles=1):
+        cycles = max(1, min(MAX_CYCLES, int(cycles)))
+        with self.lock:
+            if self.kind is not None:
+                LOGGER.warning('A %s profile is already running, %d of %d polls done' % (self.kind, self.done, self.cycles))
+                return False
+            self.kind = kind
+            self.cycles = cycles
+            self.done = 0
+        LOGGER.info('Profiling %s for the next %d polls' % (kind, cycles))
+        return True
+
+    # Call poll(*args), profiling it if a profile was requested
+    def run(self, poll, *args):
+        with self.lock:
+            kind = self.kind
+        if kind is None:
+            return poll(*args)
+
+        if self.done == 0:
+            self.begin(kind)
+        try:
+            if kind == 'cpu':
+                self.profile.enable()
+            try:
+                return poll(*args)
+            finally:
+                if kind == 'cpu':
+                    self.profile.disable()
+        finally:
+            self.done += 1
+            if self.done >= self.cycles:
+                self.finish(kind)
+
+    def begin(self, kind):
+        if kind == 'cpu':
+            self.profile = cProfile.Profile()
+        else:
+            self.started_tracing = not tracemalloc.is_tracing()
+            if self.started_tracing:
+                tracemalloc.start(TRACE_FRAMES)
+            self.baseline = tracemalloc.take_snapshot()
+
+    def finish(self, kind):
+        filename = 'darksky_profile_%s_%s.txt' % (kind, time.strftime('%Y%m%d-%H%M%S'))
+        try:
+            if kind == 'cpu':
+                report = self.cpu_report()
+            else:
+                report = self.mem_report()
+            with open(filename, 'w') as pf:
+                pf.write(report)
+            LOGGER.info('Wrote %s profile of %d polls to %s' % (kind, self.done, filename))
+        except Exception as e:
+            LOGGER.error('Failed to write %s profile: %s' % (kind, str(e)))
+
+        self.profile = None
+        self.baseline = None
+        with self.lock:
+            self.kind = None
+
+    def cpu_report(self):
+        out = io.StringIO()
+        out.write('CPU profile of %d polls\n\n' % self.done)
+        stats = pstats.Stats(self.profile, stream=out)
+        stats.strip_dirs().sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+        stats.sort_stats('tottime').print_stats(TOP_FUNCTIONS)
+        return out.getvalue()
+
+    def mem_report(self):
+        snapshot = tracemalloc.take_snapshot()
+        (current, peak) = tracemalloc.get_traced_memory()
+        if self.started_tracing:
+            tracemalloc.stop()
+
+        filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ]
+        snapshot = snapshot.filter_traces(filters)
+        baseline = self.baseline.filter_traces(filters)
+
+        lines = ['Memory profile of %d polls' % self.done,
+                 'traced: %.1f KiB current, %.1f KiB peak' % (current / 1024, peak / 1024),
+                 '',
+                 'Top allocation sites:']
+        for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+            lines.append('  ' + str(stat))
+
+        lines += ['', 'Growth since the first profiled poll:']
+        for stat in snapshot.compare_to(baseline, 'lineno')[:TOP_ALLOCATIONS]:
+            lines.append('  ' + str(stat))
+
+        lines += ['', 'Largest growth, with traceback:']
+        for stat in snapshot.compare_to(baseline, 'traceback')[:5]:
+            lines.append('  %s' % stat)
+            for line in stat.traceback.format():
+                lines.append('    ' + line)
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,152 @@
+#
+#  API call budget
+#
+#  Keep track of the number of DarkSky API calls made during the
+#  current UTC day (DarkSky's quota resets at UTC midnight) and work
+#  out how often we can fetch new data so that the daily budget is
+#  spread over the rest of the day.  Fetch more often while the
+#  weather is changing and less often while it's stable.
+#
+#  The count is saved to a file so that it survives a restart.
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import datetime
+import json
+import os
+import threading
+import time
+
+LOGGER = polyinterface.LOGGER
+
+QUOTA_FILE = 'darksky_quota.json'
+
+# Interval multipliers for volatile and stable conditions
+VOLATILE_FACTOR = 0.5
+STABLE_FACTOR = 1.5
+
+# What counts as volatile / stable between two observations
+PRECIP_RISE = 0.1       # rise in precipitation probability (0 - 1)
+PRESSURE_CHANGE = 1.0   # hPa
+STABLE_PRECIP = 0.02
+STABLE_PRESSURE = 0.3
+
+
+def utc_day(now):
+    return datetime.datetime.utcfromtimestamp(now).strftime('%Y-%m-%d')
+
+
+def seconds_left_in_day(now):
+    return 86400 - (int(now) % 86400)
+
+
+class QuotaManager:
+    def __init__(self, budget=0, min_interval=60, filename=QUOTA_FILE):
+        self.budget = budget
+        self.min_interval = min_interval
+        self.filename = filename
+        self.day = utc_day(time.time())
+        self.calls = 0
+        self.last_fetch = 0
+        self.factor = 1.0
+        self.previous = None
+        self.observed = None
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.filename) as qf:
+                data = json.load(qf)
+            if data['day'] == self.day:
+                self.calls = data['calls']
+                self.last_fetch = data['last_fetch']
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            LOGGER.warning('Ignoring unreadable quota file: ' + str(e))
+
+    def save(self):
+        tmp = self.filename + '.tmp'
+        try:
+            with open(tmp, 'w') as qf:
+                json.dump({'day': self.day, 'calls': self.calls, 'last_fetch': self.last_fetch}, qf)
+            os.replace(tmp, self.filename)
+        except Exception as e:
+            LOGGER.warning('Failed to save quota file: ' + str(e))
+
+    def rollover(self, now):
+        day = utc_day(now)
+        if day != self.day:
+            LOGGER.info('API calls used on %s: %d' % (self.day, self.calls))
+            self.day = day
+            self.calls = 0
+
+    # Count an API call.  DarkSky reports the number of calls made
+    # today with this key, which also includes calls made elsewhere.
+    def record(self, headers):
+        now = time.time()
+        with self.lock:
+            self.rollover(now)
+            self.calls += 1
+            try:
+                self.calls = max(self.calls, int(headers.get('X-Forecast-API-Calls')))
+            except (TypeError, ValueError):
+                pass
+            self.last_fetch = now
+            self.save()
+
+    # Look at the latest current conditions to decide whether the
+    # weather is volatile or stable.  The same observation (a cached
+    # response) is only looked at once.
+    def observe(self, ob):
+        if ob.get('time') is not None and ob.get('time') == self.observed:
+            return
+        self.observed = ob.get('time')
+
+        try:
+            current = (float(ob.get('precipProbability', 0)), float(ob['pressure']), float(ob.get('precipIntensity', 0)))
+        except (KeyError, TypeError, ValueError):
+            return
+
+        factor = 1.0
+        if self.previous is not None:
+            precip_rise = current[0] - self.previous[0]
+            pressure_change = abs(current[1] - self.previous[1])
+            if precip_rise >= PRECIP_RISE or pressure_change >= PRESSURE_CHANGE or current[2] > 0:
+                factor = VOLATILE_FACTOR
+            elif abs(precip_rise) < STABLE_PRECIP and pressure_change < STABLE_PRESSURE:
+                factor = STABLE_FACTOR
+        elif current[2] > 0:
+            factor = VOLATILE_FACTOR
+
+        if factor != self.factor:
+            LOGGER.info('Conditions are %s, poll interval factor %.1f' %
+                    ('volatile' if factor < 1 else 'stable' if factor > 1 else 'normal', factor))
+        self.factor = factor
+        self.previous = current
+
+    # Seconds between fetches that spreads the remaining budget over
+    # the rest of the UTC day.  calls_per_fetch is the number of API
+    # calls each fetch costs (one per location).
+    def interval(self, calls_per_fetch=1):
+        if self.budget <= 0:
+            return 0
+
+        now = time.time()
+        with self.lock:
+            self.rollover(now)
+            remaining = self.budget - self.calls
+
+        seconds = seconds_left_in_day(now)
+        if remaining < calls_per_fetch:
+            # Budget used up, wait for tomorrow
+            return seconds
+
+        interval = seconds * calls_per_fetch / remaining * self.factor
+        return min(max(interval, self.min_interval), seconds)
+
+    def due(self, calls_per_fetch=1):
+        return time.time() - self.last_fetch >= self.interval(calls_per_fetch)
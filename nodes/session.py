@@ -0,0 +1,64 @@
+#
+#  HTTP session handling for DarkSky queries
+#
+#  The controller keeps a single pooled, keep-alive session so that
+#  each poll re-uses the existing TLS connection.  All requests have
+#  connect/read timeouts and transient failures are retried with a
+#  jittered exponential backoff.
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import random
+import time
+import requests
+
+LOGGER = polyinterface.LOGGER
+
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 15
+RETRIES = 3
+BACKOFF = 1.0
+MAX_BACKOFF = 10.0
+
+# Status codes worth trying again
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+def create_session(pool_size=4):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive',
+        })
+    return session
+
+
+def backoff_delay(attempt):
+    delay = min(MAX_BACKOFF, BACKOFF * (2 ** attempt))
+    return random.uniform(0, delay)
+
+
+# Do a GET request, retrying on connection errors, timeouts and
+# server errors.  Returns the response or raises the last error.
+# With stream=True the body is read when the caller accesses it.
+def get(session, url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), retries=RETRIES, stream=False):
+    attempt = 0
+    while True:
+        try:
+            c = session.get(url, timeout=timeout, stream=stream)
+            if c.status_code not in RETRY_STATUS or attempt >= retries:
+                return c
+            LOGGER.warning('Server returned %d, retrying' % c.status_code)
+            c.close()
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if attempt >= retries:
+                raise
+            LOGGER.warning('HTTP request failed, retrying: ' + str(e))
+
+        time.sleep(backoff_delay(attempt))
+        attempt += 1
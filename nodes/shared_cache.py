@@ -0,0 +1,174 @@
+#
+#  Response cache shared by node servers on the same host
+#
+#  Responses are kept in an SQLite database that all the node servers
+#  configured with the same file use.  Entries are keyed on the grid
+#  cell of the location (latitude and longitude rounded to GRID
+#  degrees) and the query, so nearby locations share one response.
+#  Responses are always in SI units, so node servers configured for
+#  different units share them too.
+#
+#  Fetches are single-flight: before fetching, a node server marks the
+#  key as in flight.  Any other node server (or thread) that wants the
+#  same key waits for that response instead of making its own API call.
+#  A mark older than FLIGHT_TIMEOUT is assumed to be from a node server
+#  that died and is taken over.
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import json
+import os
+import sqlite3
+import threading
+import time
+
+LOGGER = polyinterface.LOGGER
+
+# Size of a grid cell in degrees, about 1km
+GRID = 0.01
+
+# How long to wait for a response someone else is fetching
+FLIGHT_TIMEOUT = 60
+WAIT_INTERVAL = 0.5
+
+# Responses with a TTL are shared for at least this long, so that node
+# servers waiting on a fetch get the response even with a short TTL.
+# Without a TTL the response isn't shared at all.
+MIN_LIFETIME = 60
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, fetched REAL, expires REAL, data TEXT)',
+    'CREATE TABLE IF NOT EXISTS inflight (key TEXT PRIMARY KEY, owner TEXT, started REAL)',
+    )
+
+
+# Round a 'latitude,longitude' location to its grid cell.  Anything
+# that isn't a coordinate pair is used as is.
+def grid_cell(location, grid=GRID):
+    try:
+        (lat, lon) = [float(v) for v in location.split(',')]
+    except ValueError:
+        return location.replace(' ', '')
+    return '%.4f,%.4f' % (round(lat / grid) * grid, round(lon / grid) * grid)
+
+
+def make_key(location, exclude, days, hours=0):
+    return '%s|%s|%d|%d' % (grid_cell(location), ','.join(sorted(exclude)), days, hours)
+
+
+class SharedCache:
+    def __init__(self, filename=''):
+        self.filename = filename
+        self.initialized = None
+        self.hits = 0
+
+    def enabled(self):
+        return self.filename != ''
+
+    def connect(self):
+        db = sqlite3.connect(self.filename, timeout=10, isolation_level=None)
+        if self.initialized != self.filename:
+            db.execute('PRAGMA journal_mode=WAL')
+            for statement in SCHEMA:
+                db.execute(statement)
+            self.initialized = self.filename
+        return db
+
+    def owner(self):
+        return '%d.%d' % (os.getpid(), threading.get_ident())
+
+    # Returns (entry, fetched) where entry is { 'data', 'fetched',
+    # 'expires' } and fetched is True if fetch was called to get it.
+    # fetch() returns (data, lifetime), data None if the fetch failed
+    # and lifetime None for a response that shouldn't be shared.  The
+    # entry is None if there's no response.
+    def get(self, key, fetch):
+        try:
+            db = self.connect()
+        except sqlite3.Error as e:
+            LOGGER.warning('Shared cache %s unavailable: %s' % (self.filename, str(e)))
+            return self.call(fetch)
+
+        try:
+            deadline = time.time() + FLIGHT_TIMEOUT
+            while True:
+                try:
+                    (entry, owner) = self.claim(db, key)
+                except sqlite3.Error as e:
+                    LOGGER.warning('Shared cache error: ' + str(e))
+                    return self.call(fetch)
+                if entry is not None:
+                    self.hits += 1
+                    LOGGER.debug('shared cache hit for ' + key)
+                    return (entry, False)
+                if owner:
+                    break
+                if time.time() > deadline:
+                    LOGGER.warning('Gave up waiting for the shared response for ' + key)
+                    return self.call(fetch)
+                time.sleep(WAIT_INTERVAL)
+
+            try:
+                (entry, fetched) = self.call(fetch)
+                if entry is not None and entry['expires'] > entry['fetched']:
+                    self.put(db, key, entry)
+                return (entry, fetched)
+            finally:
+                self.release(db, key)
+        finally:
+            db.close()
+
+    def call(self, fetch):
+        (data, lifetime) = fetch()
+        if data is None:
+            return (None, True)
+        now = time.time()
+        if lifetime is None or lifetime <= 0:
+            lifetime = 0
+        else:
+            lifetime = max(lifetime, MIN_LIFETIME)
+        return ({'data': data, 'fetched': now, 'expires': now + lifetime}, True)
+
+    # In one transaction, return a fresh response or, if nobody else
+    # is fetching it, mark the key as in flight for us.  Returns
+    # (entry, owner), owner is True if we should fetch.
+    def claim(self, db, key):
+        now = time.time()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute('SELECT fetched, expires, data FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is not None and row[1] > now:
+                db.execute('COMMIT')
+                return ({'fetched': row[0], 'expires': row[1], 'data': json.loads(row[2])}, False)
+
+            row = db.execute('SELECT owner, started FROM inflight WHERE key = ?', (key,)).fetchone()
+            owner = row is None or row[1] < now - FLIGHT_TIMEOUT
+            if owner:
+                db.execute('INSERT OR REPLACE INTO inflight VALUES (?, ?, ?)', (key, self.owner(), now))
+            db.execute('COMMIT')
+            return (None, owner)
+        except:
+            db.execute('ROLLBACK')
+            raise
+
+    def put(self, db, key, entry):
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                db.execute('DELETE FROM responses WHERE expires <= ?', (time.time(),))
+                db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                        (key, entry['fetched'], entry['expires'], json.dumps(entry['data'])))
+                db.execute('COMMIT')
+            except:
+                db.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            LOGGER.warning('Failed to save shared response: ' + str(e))
+
+    def release(self, db, key):
+        try:
+            db.execute('DELETE FROM inflight WHERE key = ? AND owner = ?', (key, self.owner()))
+        except sqlite3.Error as e:
+            LOGGER.warning('Failed to release shared cache key: ' + str(e))
@@ -0,0 +1,52 @@
+#
+#  Snapshot of the last known driver values
+#
+#  After each good poll, the driver values of all nodes are saved along
+#  with the time of the data.  At startup they're restored before the
+#  first query so the ISY sees the last known values instead of zeros.
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import json
+import os
+
+LOGGER = polyinterface.LOGGER
+
+SNAPSHOT_FILE = 'darksky_snapshot.json'
+
+
+# nodes is the controller's node dictionary, key identifies the
+# configuration the values belong to (the locations and units).
+def save(nodes, data_time, key, filename=SNAPSHOT_FILE):
+    values = {}
+    for node in nodes.values():
+        values[node.address] = {d['driver']: d['value'] for d in node.drivers if d['driver'] != 'ST'}
+
+    tmp = filename + '.tmp'
+    try:
+        with open(tmp, 'w') as sf:
+            json.dump({'time': data_time, 'key': key, 'nodes': values}, sf, separators=(',', ':'))
+        os.replace(tmp, filename)
+    except Exception as e:
+        LOGGER.warning('Failed to save snapshot: ' + str(e))
+
+
+# Returns (data_time, { address: { driver: value } }) or None if there
+# is no usable snapshot for this configuration.
+def load(key, filename=SNAPSHOT_FILE):
+    try:
+        with open(filename) as sf:
+            data = json.load(sf)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        LOGGER.warning('Ignoring unreadable snapshot: ' + str(e))
+        return None
+
+    if data.get('key') != key:
+        LOGGER.info('Snapshot is for a different configuration, ignoring it.')
+        return None
+
+    return (data['time'], data['nodes'])
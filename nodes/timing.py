@@ -0,0 +1,88 @@
+#
+#  Poll timing
+#
+#  Keep the last N durations of each poll phase in a fixed size ring
+#  and report percentiles from them.
+#
+#  Phases:
+#    fetch    - request sent until the response headers are received
+#               (includes DNS / connect / TLS for a new connection)
+#    download - reading the response body
+#    decode   - JSON decode / field extraction
+#    et       - evapotranspiration calculations
+#    update   - mapping data to driver values (includes et)
+#    publish  - sending the driver updates
+#    poll     - the whole poll
+
+import array
+import threading
+import time
+
+SAMPLES = 64
+
+
+class RollingStats:
+    def __init__(self, size=SAMPLES):
+        self.samples = array.array('d', bytes(8 * size))
+        self.size = size
+        self.count = 0
+        self.index = 0
+        self.last = 0.0
+
+    def add(self, value):
+        self.samples[self.index] = value
+        self.index = (self.index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+        self.last = value
+
+    # (p50, p95, max)
+    def summary(self):
+        if self.count == 0:
+            return (0.0, 0.0, 0.0)
+        values = sorted(self.samples[:self.count])
+        return (values[int(0.5 * self.count)],
+                values[min(self.count - 1, int(0.95 * self.count))],
+                values[-1])
+
+
+class Phase:
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.timer.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class PollTimer:
+    def __init__(self, size=SAMPLES):
+        self.size = size
+        self.phases = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self.lock:
+            stats = self.phases.get(name)
+            if stats is None:
+                stats = RollingStats(self.size)
+                self.phases[name] = stats
+            stats.add(seconds)
+
+    # usage:
+    #   with timer.phase('decode'):
+    #       ...
+    def phase(self, name):
+        return Phase(self, name)
+
+    def report(self):
+        lines = []
+        with self.lock:
+            for name in sorted(self.phases):
+                (p50, p95, mx) = self.phases[name].summary()
+                lines.append('%-8s p50 %7.1f ms  p95 %7.1f ms  max %7.1f ms' % (name, p50 * 1000, p95 * 1000, mx * 1000))
+        return lines
@@ -5,16 +5,76 @@
 #  the requested unit configuration.
 #
 #  valid unit configurations are:
-#   metric, imperial, si (same as metric), us (same as imperial), uk
+#   metric, imperial, si (same as metric), us (same as imperial), uk,
+#   ca (metric with wind speed in km/h)
 #
 #  Ideally, there should be no conflicts between forecast and current
 #  condition driver types
+#
+#  Data is always requested in SI units.  get_converter() returns the
+#  conversion from SI to the units of a unit configuration, built once
+#  per configuration from the UOM tables.
+
+# value * scale + offset, rounded to prec + extra decimal places.
+# Keyed on (SI uom, uom).
+CONVERSIONS = {
+        (4, 17): (1.8, 32.0, 0),            # C -> F
+        (49, 48): (2.2369363, 0.0, 0),      # m/s -> mph
+        (49, 32): (3.6, 0.0, 0),            # m/s -> km/h
+        (46, 24): (1 / 25.4, 0.0, 1),       # mm/h -> in/h
+        (82, 105): (1 / 25.4, 0.0, 1),      # mm -> in
+        (83, 116): (0.62137119, 0.0, 0),    # km -> miles
+        (106, 120): (1 / 25.4, 0.0, 1),     # mm/day -> in/day
+        }
+
+
+class Converter:
+    def __init__(self, units):
+        si = get_uom('si')
+        target = get_uom(units)
+        self.coefficients = {}
+        for driver in target:
+            if target[driver] != si[driver]:
+                self.coefficients[driver] = CONVERSIONS[(si[driver], target[driver])]
+
+    # Convert a list of (driver, value, prec) in SI units
+    def convert(self, values):
+        coefficients = self.coefficients
+        if len(coefficients) == 0:
+            return values
+
+        converted = []
+        for (driver, value, prec) in values:
+            c = coefficients.get(driver)
+            if c is not None:
+                value = value * c[0] + c[1]
+                prec += c[2]
+            converted.append((driver, value, prec))
+        return converted
+
+    # Convert a single value, returns (value, prec)
+    def value(self, driver, value, prec=3):
+        return self.convert([(driver, value, prec)])[0][1:]
+
+
+_converters = {}
+
+
+def get_converter(units):
+    unit_cfg = units.lower()
+    if unit_cfg not in _converters:
+        _converters[unit_cfg] = Converter(unit_cfg)
+    return _converters[unit_cfg]
 
 
 def get_uom(units):
     unit_cfg = units.lower()
 
-    if unit_cfg == 'metric' or unit_cfg == 'si' or unit_cfg.startswith('m'):
+    if unit_cfg == 'ca':
+        uom = get_uom('si')
+        uom['GV4'] = 32     # wind speed
+        uom['GV5'] = 32     # wind gusts
+    elif unit_cfg == 'metric' or unit_cfg == 'si' or unit_cfg.startswith('m'):
         uom = {
             'ST': 2,   # node server status
             'CLITEMP': 4,   # temperature
@@ -39,12 +99,24 @@ def get_uom(units):
             'GV12': 25,     # climate intensity
             'GV13': 25,     # climate conditions
             'GV14': 22,     # cloud conditions
-            'DISTANC': 38,  # visibility
+            'GV15': 56,     # hour
+            'GV16': 2,      # data is stale
+            'DISTANC': 83,  # visibility
             'UV': 71,       # UV index
             'GV17': 56,     # Air Quality
             'GV18': 22,     # chance of precipitation
             'GV19': 25,     # day of week
             'GV20': 106,    # ETo
+            'GV21': 42,     # fetch latency
+            'GV22': 56,     # payload bytes
+            'GV23': 56,     # consecutive failures
+            'GV24': 58,     # data age
+            'GV25': 46,     # hourly ETo
+            'GV26': 45,     # minutes until precipitation starts
+            'GV27': 45,     # minutes until precipitation stops
+            'GV28': 56,     # active alerts
+            'GV29': 25,     # highest alert severity
+            'GV30': 45,     # minutes until an alert expires
         }
     elif unit_cfg == 'uk':
         uom = {
@@ -55,14 +127,14 @@ def get_uom(units):
             'WINDDIR': 76,  # direction
             'DEWPT': 4,     # dew point
             'SOLRAD': 74,   # solar radiation
-            'RAINRT': 24,   # rain rate
+            'RAINRT': 46,   # rain rate
             'GV0': 4,       # max temp
             'GV1': 4,       # min temp
             'GV2': 4,       # feels like
             'GV3': 4,       # ??feels like
             'GV4': 48,      # wind speed
             'GV5': 48,      # wind gusts
-            'GV6': 105,     # rain
+            'GV6': 82,      # rain
             'GV7': 82,      # snow
             'GV8': 82,      # snow depth
             'GV9': 56,      # moon phase
@@ -71,12 +143,24 @@ def get_uom(units):
             'GV12': 25,     # climate intensity
             'GV13': 25,     # climate conditions
             'GV14': 22,     # cloud conditions
+            'GV15': 56,     # hour
+            'GV16': 2,      # data is stale
             'DISTANC': 116, # visibility
             'UV': 71,       # UV index
             'GV17': 56,     # Air Quality
             'GV18': 22,     # chance of precipitation
             'GV19': 25,     # day of week
             'GV20': 120,    # ETo
+            'GV21': 42,     # fetch latency
+            'GV22': 56,     # payload bytes
+            'GV23': 56,     # consecutive failures
+            'GV24': 58,     # data age
+            'GV25': 24,     # hourly ETo
+            'GV26': 45,     # minutes until precipitation starts
+            'GV27': 45,     # minutes until precipitation stops
+            'GV28': 56,     # active alerts
+            'GV29': 25,     # highest alert severity
+            'GV30': 45,     # minutes until an alert expires
         }
     else:
         uom = {
@@ -103,12 +187,24 @@ def get_uom(units):
             'GV12': 25,     # climate intensity
             'GV13': 25,     # climate conditions
             'GV14': 22,     # cloud conditions
+            'GV15': 56,     # hour
+            'GV16': 2,      # data is stale
             'DISTANC': 116, # visibility
             'UV': 71,       # UV index
             'GV17': 56,     # Air Quality
             'GV18': 22,     # chance of precipitation
             'GV19': 25,     # day of week
             'GV20': 120,    # ETo
+            'GV21': 42,     # fetch latency
+            'GV22': 56,     # payload bytes
+            'GV23': 56,     # consecutive failures
+            'GV24': 58,     # data age
+            'GV25': 24,     # hourly ETo
+            'GV26': 45,     # minutes until precipitation starts
+            'GV27': 45,     # minutes until precipitation stops
+            'GV28': 56,     # active alerts
+            'GV29': 25,     # highest alert severity
+            'GV30': 45,     # minutes until an alert expires
         }
 
     return uom
@@ -14,32 +14,41 @@ VERSION_FILE = "profile/version.txt"
 NODEDEF_TMPL = "  <nodeDef id=\"%s\" nodeType=\"139\" nls=\"%s\">\n"
 STATUS_TMPL = "      <st id=\"%s\" editor=\"%s\" />\n"
 
-# unit of measure to editor mapping
+# unit of measure to editor mapping.  Every unit of measure a driver
+# can be published with (see nodes/uom.py) needs an entry and the
+# editor needs a range for it in profile/editor/editors.xml.
 uom = {
-        4 : 'TEMP_C',
-        17 : 'TEMP_F',
         2 : 'bool',
+        4 : 'TEMPERATURE',
+        17 : 'TEMPERATURE',
         22 : 'PERCENT',
-        117 : 'MB',
-        48 : 'MPH',
-        49 : 'MPS',
+        23 : 'PRESSURE',
+        117 : 'PRESSURE',
+        118 : 'PRESSURE',
+        32 : 'SPEED',
+        48 : 'SPEED',
+        49 : 'SPEED',
         76 : 'DEGREES',
-        0 : 'INCHES',
-        82 : 'MM',
+        82 : 'RAIN',
+        105 : 'RAIN',
         36 : 'LUMIN',
         56 : 'int',
         38 : 'METERS',
+        83 : 'DISTANCE',
+        116 : 'DISTANCE',
         27 : 'COVERAGE',
         70 : 'INTENSITY',
         25 : 'CONDITIONS',
-        118 : 'HPA',
-        23 : 'INHG',
         71 : 'UV',
-        116 : 'MILES',
-        46 : 'mmhr',
-        24 : 'inhr',
+        74 : 'SOLARRAD',
+        46 : 'RAINRT',
+        24 : 'RAINRT',
         9 : 'DAY',
         106 : 'ET',
+        120 : 'ET',
+        42 : 'MSEC',
+        45 : 'MINUTES',
+        58 : 'SECONDS',
         }
 
 index_editor = {
@@ -47,13 +56,77 @@ index_editor = {
         'GV13' : 'CONDITIONS',
         }
 
+# drivers whose editor doesn't follow from the unit of measure
+driver_editor = {
+        'GV9' : 'MOON',
+        'GV10' : 'OZONE',
+        }
+
+# controller status drivers that need their own editor range
+status_editor = {
+        'GV22' : 'BYTES',
+        'GV23' : 'COUNT',
+        }
+
+# hourly forecast drivers that need their own editor range
+hourly_editor = {
+        'GV15' : 'HOUR',
+        'GV25' : 'ET_HOURLY',
+        }
+
+# nowcast drivers that need their own editor range
+nowcast_editor = {
+        'GV26' : 'MINUTES',
+        'GV27' : 'MINUTES',
+        'RAINRT' : 'RAINRT',
+        'GV6' : 'RAIN',
+        }
+
+# alerts drivers
+alerts_editor = {
+        'GV28' : 'COUNT',
+        'GV29' : 'SEVERITY',
+        'GV30' : 'EXPIRY',
+        }
+
+# statistics drivers that need their own editor range
+stats_editor = {
+        'BARPRES' : 'PRESSURE_TREND',
+        }
+
+
+# Editor for a driver, node_editor holds the node's own overrides
+def get_editor(d, node_editor={}):
+    if d['driver'] in node_editor:
+        return node_editor[d['driver']]
+    if d['driver'] in driver_editor:
+        return driver_editor[d['driver']]
+    if d['uom'] == 25:
+        return index_editor[d['driver']]
+    return uom[d['uom']]
+
+
+def write_node(nodedef, node_id, nls, drivers, node_editor={}, commands=''):
+    nodedef.write(NODEDEF_TMPL % (node_id, nls))
+    nodedef.write("    <editors />\n")
+    nodedef.write("    <sts>\n")
+    for d in drivers:
+        nodedef.write(STATUS_TMPL % (d['driver'], get_editor(d, node_editor)))
+    nodedef.write("    </sts>\n")
+    nodedef.write("    <cmds>\n")
+    nodedef.write("      <sends />\n")
+    nodedef.write("      <accepts>\n")
+    nodedef.write(commands)
+    nodedef.write("      </accepts>\n")
+    nodedef.write("    </cmds>\n")
+    nodedef.write("  </nodeDef>\n\n")
+
 
 # Create a node definition file.
 # 
-# We're assuming that we're just creating the definition for the controller
-# node and that to do that, we just iterate through the driver list to
-# build the status section of the node definition.
-def write_profile(logger, drivers, daily_drivers):
+# The driver lists come from the node classes, which build them from
+# the same tables (nodes/mapping.py) the nodes use to publish.
+def write_profile(logger, drivers, current_drivers, daily_drivers, hourly_drivers, nowcast_drivers, alerts_drivers, stats_drivers):
     sd = get_server_data(logger)
     if sd is False:
         logger.error("Unable to complete without server data...")
@@ -64,49 +137,43 @@ def write_profile(logger, drivers, daily_drivers):
         try:
             os.makedirs("profile/nodedef")
         except:
-            LOGGER.error('unable to create node definition directory.')
+            logger.error('unable to create node definition directory.')
 
     # Write the node definition file
     nodedef = open("profile/nodedef/nodedef.xml", "w")
     nodedef.write("<nodeDefs>\n")
 
-    nodedef.write(NODEDEF_TMPL % ('dsweather', 'dsk'))
-    nodedef.write("    <editors />\n")
-    nodedef.write("    <sts>\n")
-    for d in drivers:
-        if d['uom'] == 25:
-            nodedef.write(STATUS_TMPL % (d['driver'], index_editor[d['driver']]))
-        else:
-            nodedef.write(STATUS_TMPL % (d['driver'], uom[d['uom']]))
-    nodedef.write("    </sts>\n")
-    nodedef.write("    <cmds>\n")
-    nodedef.write("      <sends />\n")
-    nodedef.write("      <accepts>\n")
-    nodedef.write("        <cmd id=\"DISCOVER\" />\n")
-    nodedef.write("        <cmd id=\"REMOVE_NOTICES_ALL\" />\n")
-    nodedef.write("        <cmd id=\"UPDATE_PROFILE\" />\n")
-    nodedef.write("      </accepts>\n")
-    nodedef.write("    </cmds>\n")
-    nodedef.write("  </nodeDef>\n\n")
+    commands = "        <cmd id=\"DISCOVER\" />\n"
+    commands += "        <cmd id=\"REMOVE_NOTICES_ALL\" />\n"
+    commands += "        <cmd id=\"UPDATE_PROFILE\" />\n"
+    commands += "        <cmd id=\"DEBUG\">\n"
+    commands += "\t\t\t<p id=\"\" editor=\"DEBUG\" init=\"30\"/>\n"
+    commands += "\t\t</cmd>\n"
+    for cmd in ['PROFILE_CPU', 'PROFILE_MEM']:
+        commands += "        <cmd id=\"%s\">\n" % cmd
+        commands += "          <p id=\"\" editor=\"CYCLES\" init=\"1\" />\n"
+        commands += "        </cmd>\n"
+    write_node(nodedef, 'dsweather', 'dsk', drivers, status_editor, commands)
+
+    # Current Conditions Node (additional locations)
+    write_node(nodedef, 'current', 'dsk', current_drivers)
 
     # Daily Forecast Node
-    nodedef.write(NODEDEF_TMPL % ('daily', 'dsk'))
-    #nodedef.write("    <editors />\n")
-    nodedef.write("    <sts>\n")
-    for d in daily_drivers:
-        if d['uom'] == 25:
-            nodedef.write(STATUS_TMPL % (d['driver'], index_editor[d['driver']]))
-        else:
-            nodedef.write(STATUS_TMPL % (d['driver'], uom[d['uom']]))
-    nodedef.write("    </sts>\n")
-    nodedef.write("    <cmds>\n")
-    nodedef.write("      <sends />\n")
-    nodedef.write("      <accepts>\n")
-    nodedef.write("      </accepts>\n")
-    nodedef.write("    </cmds>\n")
-    nodedef.write("  </nodeDef>\n\n")
+    write_node(nodedef, 'daily', 'dsk', daily_drivers)
+
+    # Hourly Forecast Node
+    write_node(nodedef, 'hourly', 'dsk', hourly_drivers, hourly_editor)
+
+    # Precipitation Nowcast Node
+    write_node(nodedef, 'nowcast', 'dskn', nowcast_drivers, nowcast_editor)
+
+    # Weather Alerts Node
+    write_node(nodedef, 'alerts', 'dska', alerts_drivers, alerts_editor)
+
+    # Rolling Statistics Node
+    write_node(nodedef, 'stats', 'dsks', stats_drivers, stats_editor)
 
-    nodedef.write("</nodeDefs>")
+    nodedef.write("</nodeDefs>\n")
 
     nodedef.close()
 
@@ -204,4 +271,18 @@ if __name__ == "__main__":
             logger.info('{0} Not Generating new profile since local version {1} is the same current {2}'.format(pfx,local_version,sd['profile_version']))
         else:
             logger.info('{0} Generating new profile since local version {1} is not current {2}'.format(pfx,local_version,sd['profile_version']))
-            #write_profile(logger, [])
+            from nodes import darksky
+            from nodes import darksky_current
+            from nodes import darksky_daily
+            from nodes import darksky_hourly
+            from nodes import darksky_nowcast
+            from nodes import darksky_alerts
+            from nodes import darksky_stats
+            write_profile(logger,
+                    darksky.Controller.drivers,
+                    darksky_current.CurrentNode.drivers,
+                    darksky_daily.DailyNode.drivers,
+                    darksky_hourly.HourlyNode.drivers,
+                    darksky_nowcast.NowcastNode.drivers,
+                    darksky_alerts.AlertsNode.drivers,
+                    darksky_stats.StatsNode.drivers)